@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Recursive-traversal disassembly: this follows the flow of control from an
+entry point (SET PC, JSR, the IFx skips and plain fall-through) instead of
+decoding memory linearly, so code and data don't get mixed up. The result is a
+ControlFlowGraph of BasicBlocks, which is useful for more than disassembly --
+anything that wants to know where the code is can use it.
+"""
+
+from sixteen.words import tables
+from sixteen.dis import Instruction, decode, operand
+from sixteen.utilities import OpcodeError
+
+
+def within(address, size):
+    """Only a whole memory wraps around, the way the PC does; in anything
+    shorter, addresses past the end are just outside it.
+    """
+    return address % size if size == 0x10000 else address
+
+
+def successors(instruction, words):
+    """Given an instruction and the memory it lives in, return a list of
+    (address, kind) pairs for everywhere control can go next, and a string
+    that describes how it leaves: "fall", "branch", "jump", "call", "return"
+    or "indirect".
+    """
+    size = len(words)
+    after = within(instruction.next, size)
+    op, codes = instruction.op, instruction.codes
+    if op == "JSR":
+        target = instruction.literal(0)
+        if target == None:
+            return [(after, "fall")], "indirect"
+        return [(target, "call"), (after, "fall")], "call"
+    elif op.startswith("IF"):
+        # when the test fails, the CPU skips over the next instruction
+        word = words[after] if after < size else 0
+        skip = within(after + tables.length[word], size)
+        return [(after, "fall"), (skip, "skip")], "branch"
+    elif codes[0] != 0x1c:
+        return [(after, "fall")], "fall"
+    # and from here on, this instruction writes to PC.
+    value = instruction.literal(1)
+    if op == "SET" and codes[1] == 0x18:
+        return [], "return"
+    elif value == None:
+        return [], "indirect"
+    elif op == "SET":
+        return [(value, "jump")], "jump"
+    elif op == "ADD":
+        return [((after + value) & 0xffff, "jump")], "jump"
+    elif op == "SUB":
+        return [((after - value) & 0xffff, "jump")], "jump"
+    else:
+        return [], "indirect"
+
+
+class BasicBlock(object):
+    """A straight run of instructions that is only entered at the top and only
+    left at the bottom. "successors" and "predecessors" are lists of (address,
+    kind) pairs; "exit" says how the last instruction leaves the block.
+    """
+    def __init__(self, start):
+        self.start = start
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+        self.exit = "fall"
+
+    @property
+    def end(self):
+        "The address just past the last instruction of this block."
+        return self.instructions[-1].next
+
+    def __iter__(self):
+        return iter(self.instructions)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __repr__(self):
+        return "<BasicBlock 0x%04x-0x%04x -> %s>" % (self.start, self.end,
+                ", ".join("0x%04x" % a for a, _ in self.successors))
+
+
+class ControlFlowGraph(object):
+    """Given a sequence of words and some entry points, follow every path
+    control can take through them and split the code into basic blocks.
+
+    "instructions" maps addresses to every decoded Instruction, "blocks" maps
+    the addresses blocks start at to BasicBlocks, "labels" maps the targets of
+    jumps and calls to synthesized label names, and "invalid" is the set of
+    addresses control reaches that don't hold a valid instruction -- including
+    ones past the end, unless the words are a whole 64K memory.
+    """
+    def __init__(self, words, entries=(0,)):
+        self.words = words
+        self.entries = list(entries)
+        self.instructions = {}
+        self.blocks = {}
+        self.labels = {}
+        self.invalid = set()
+        # the addresses that something jumps into the middle of.
+        self.overlapping = set()
+        self._edges = {}
+        self._exits = {}
+        leaders = self._explore()
+        self._split(leaders)
+        self._label()
+
+    def _explore(self):
+        "Walk from the entry points, decoding everything we can reach."
+        # which instruction each word that we've decoded belongs to
+        owners = {}
+        leaders = set(self.entries)
+        pending = list(reversed(self.entries))
+        while pending:
+            address = pending.pop()
+            if address in self.instructions or address in self.invalid:
+                continue
+            if address in owners:
+                self.overlapping.add(address)
+                continue
+            if address >= len(self.words):
+                # control runs off the end of the buffer.
+                self.invalid.add(address)
+                continue
+            try:
+                instruction = decode(self.words, address)
+            except OpcodeError:
+                self.invalid.add(address)
+                continue
+            claimed = [within(address + n, len(self.words))
+                    for n in xrange(len(instruction))]
+            if any(a in owners for a in claimed):
+                self.overlapping.add(address)
+                continue
+            for a in claimed:
+                owners[a] = address
+            self.instructions[address] = instruction
+            edges, exit = successors(instruction, self.words)
+            self._edges[address] = edges
+            self._exits[address] = exit
+            for target, kind in reversed(edges):
+                # anything that isn't just the next instruction starts a block
+                if kind != "fall" or exit != "fall":
+                    leaders.add(target)
+                pending.append(target)
+        return leaders
+
+    def _split(self, leaders):
+        "Split the decoded instructions into basic blocks at the leaders."
+        for start in sorted(leaders):
+            if start not in self.instructions:
+                continue
+            block = BasicBlock(start)
+            address = start
+            while True:
+                instruction = self.instructions[address]
+                block.instructions.append(instruction)
+                edges = self._edges[address]
+                block.exit = self._exits[address]
+                if block.exit != "fall":
+                    break
+                (address, _), = edges
+                if address in leaders or address not in self.instructions:
+                    break
+            for target, kind in self._edges[block.instructions[-1].address]:
+                if target in self.instructions:
+                    block.successors.append((target, kind))
+                elif block.exit == "fall" or target in self.invalid:
+                    block.exit = "invalid"
+            self.blocks[start] = block
+        for block in self.blocks.itervalues():
+            for target, kind in block.successors:
+                self.blocks[target].predecessors.append((block.start, kind))
+
+    def _label(self):
+        "Make up names for everywhere that's jumped or called to."
+        for block in self.blocks.itervalues():
+            for target, kind in block.successors:
+                if kind == "call":
+                    self.labels[target] = "sub_%04x" % target
+                elif kind == "jump":
+                    self.labels.setdefault(target, "label_%04x" % target)
+
+    def __iter__(self):
+        "Iterate over the blocks in address order."
+        return (self.blocks[a] for a in sorted(self.blocks))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def block_at(self, address):
+        "Return the block containing the given address, or None."
+        for block in self.blocks.itervalues():
+            if block.start <= address < block.end:
+                return block
+
+    def edges(self):
+        "Iterate over every (source, target, kind) edge between blocks."
+        for block in self:
+            for target, kind in block.successors:
+                yield block.start, target, kind
+
+    def text(self, instruction):
+        """Disassemble an instruction, using labels for the literal targets of
+        jumps and calls. If the assembler wouldn't turn the text back into the
+        same words, fall back to a DAT.
+        """
+        args = []
+        for n, (code, word) in enumerate(zip(instruction.codes,
+                instruction.operands)):
+            writes_pc = instruction.op == "JSR" or (instruction.op == "SET"
+                    and instruction.codes[0] == 0x1c and n == 1)
+            if code == 0x1f and writes_pc and word in self.labels:
+                args.append(self.labels[word])
+            # long literals this small would get assembled as short ones
+            elif code == 0x1f and word <= 0x1f:
+                return "DAT %s ; %s" % (", ".join("0x%04x" % w for w in
+                    instruction.words), instruction)
+            else:
+                args.append(operand(code, word))
+        return "%s %s" % (instruction.op, ", ".join(args))
+
+    def listing(self, addresses=False):
+        """Iterate over lines of assembly for everything up to the last
+        non-zero word or decoded instruction, with synthesized labels. Words
+        that aren't reachable code become DATs.
+        """
+        end = max([i.next for i in self.instructions.itervalues()] + [0])
+        for n in xrange(len(self.words) - 1, end - 1, -1):
+            if self.words[n]:
+                end = n + 1
+                break
+        address = 0
+        while address < end:
+            start = address
+            if address in self.instructions:
+                instruction = self.instructions[address]
+                line = self.text(instruction)
+                address = instruction.next
+            else:
+                data = []
+                while (address < end and address not in self.instructions
+                        and len(data) < 8):
+                    if data and address in self.labels:
+                        break
+                    data.append(self.words[address])
+                    address += 1
+                line = "DAT %s" % ", ".join("0x%04x" % w for w in data)
+            if start in self.labels:
+                line = ":%s %s" % (self.labels[start], line)
+            if addresses:
+                line = "%-40s ; 0x%04x" % (line, start)
+            yield line
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Keeping time: run a cpu at a steady clock rate, whatever's hosting it.
+
+The clock is the cpu's own "cycles" count. The governor works out how many
+cycles should have run by now from when it started, so oversleeping or a slow
+slice gets made up for in the next one instead of adding up.
+"""
+
+import time
+from sixteen.utilities import OpcodeError
+
+
+class Governor(object):
+    """Run a cpu at "rate" cycles a second (or as fast as it'll go, if the
+    rate is None), in slices of about "interval" seconds. Between slices,
+    control goes back to whatever's hosting the cpu -- a curses loop, say, or
+    the reactor -- so it can deal with input and draw things.
+
+    If the host can't keep up, it falls behind by at most "lag" seconds' worth
+    of cycles; anything more is forgotten rather than run in a burst later.
+    Either way, no slice runs more than "burst" slices' worth of cycles, so
+    the host gets control back often; the rest is left for the next ones.
+    "achieved" is the rate actually reached over the last second or so.
+    """
+    # the nominal clock rate of a DCPU-16.
+    rate = 100000
+    interval = 0.01
+    lag = 0.25
+    burst = 2
+    # how many cycles to run between looking at the time, when running flat
+    # out.
+    chunk = 1000
+
+    achieved = 0.0
+
+    def __init__(self, cpu, rate=rate, interval=interval, clock=time.time):
+        self.cpu = cpu
+        self.rate = rate
+        self.interval = interval
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        "Start counting from now, forgetting about any debt."
+        now = self.clock()
+        self._start, self._start_cycles = now, self.cpu.cycles
+        self._mark, self._mark_cycles = now, self.cpu.cycles
+
+    def due(self):
+        "Return how many cycles ought to be run now to be on time."
+        now = self.clock()
+        self.measure(now)
+        if self.rate == None:
+            return self.chunk
+        elapsed = now - self._start
+        target = self._start_cycles + int(round(elapsed * self.rate))
+        behind = target - self.cpu.cycles
+        most = int(self.lag * self.rate)
+        if behind > most:
+            # we can't keep up; pretend we started a little later.
+            self._start += float(behind - most) / self.rate
+            behind = most
+        most = int(self.burst * self.interval * self.rate)
+        return max(0, min(behind, most))
+
+    def skip(self, limit):
+        """If the cpu's stopped (see LoopDetecting), count the cycles that
+        have come due since it was last run as spent going around its loop,
+        up to "limit" seconds' worth, and return how many that was. This is
+        for hosts that don't run slices at all while a program's just waiting
+        for something, so its clock doesn't stand still meanwhile.
+        """
+        looping = getattr(self.cpu, "is_looping", None)
+        if self.rate == None or looping == None or not looping():
+            return 0
+        elapsed = self.clock() - self._start
+        target = self._start_cycles + int(round(elapsed * self.rate))
+        count = max(0, min(target - self.cpu.cycles, int(limit * self.rate)))
+        self.cpu.fast_forward(count)
+        return count
+
+    def measure(self, now):
+        "Update the achieved rate about once a second."
+        elapsed = now - self._mark
+        if elapsed >= 1.0:
+            self.achieved = (self.cpu.cycles - self._mark_cycles) / elapsed
+            self._mark, self._mark_cycles = now, self.cpu.cycles
+
+    def execute(self, count):
+        """Run up to a number of cycles and return how many ran. If the cpu
+        can tell that it's looping (see LoopDetecting), the rest are skipped
+        but still counted.
+        """
+        cpu = self.cpu
+        looping = getattr(cpu, "is_looping", None)
+        for n in xrange(count):
+            if looping != None and looping():
+                cpu.fast_forward(count - n)
+                return n
+            cpu.cycle()
+        return count
+
+    def slice(self):
+        """Run one slice's worth of cycles, and return how long to wait before
+        the next one. OpcodeErrors get passed on.
+        """
+        pump = getattr(self.cpu, "pump", None)
+        if pump != None:
+            pump()
+        if self.rate == None:
+            # keep going until the slice is used up.
+            end = self.clock() + self.interval
+            while self.clock() < end:
+                self.execute(self.due())
+            return 0
+        self.execute(self.due())
+        return self.wait()
+
+    def wait(self):
+        """Return how long to wait before the next slice, for hosts that run
+        the cycles themselves.
+        """
+        if self.rate == None:
+            return 0
+        # the next slice starts when enough time for one has gone by.
+        ahead = self.cpu.cycles - self._start_cycles
+        next_start = self._start + float(ahead) / self.rate + self.interval
+        return max(0, next_start - self.clock())
+
+    def run(self, between=None, sleep=time.sleep):
+        """Run until the cpu hits an invalid opcode or "between" (which gets
+        called after every slice) returns False.
+        """
+        while True:
+            try:
+                wait = self.slice()
+            except OpcodeError:
+                return
+            if between != None and between() == False:
+                return
+            sleep(wait)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import time
 import curses 
 import locale
 from sixteen.dcpu16 import DCPU16
+from sixteen.input import InputCPU
 from sixteen.memorymap import MemoryMap
 
 
@@ -44,55 +46,111 @@ class Curses(object):
         return getattr(self.screen, name)
 
 
-class TerminalCPU(DCPU16):
+class TerminalCPU(DCPU16, InputCPU):
     # speculative: vram starts at 0x8000 and ends at 0x8180
     vram = (0x8000, 0x8180)
     # speculative: height, width of the display
     height, width = (12, 32)
+    # how many times a second the terminal gets redrawn, at most.
+    fps = 30
 
-    input_buffer = []
+    # the dcpu's rgb bits, in the order curses numbers its colors.
+    curses_colors = [
+        curses.COLOR_BLACK, curses.COLOR_BLUE, curses.COLOR_GREEN,
+        curses.COLOR_CYAN, curses.COLOR_RED, curses.COLOR_MAGENTA,
+        curses.COLOR_YELLOW, curses.COLOR_WHITE,
+    ]
 
     def __init__(self, c):
         """Given a curses window, initialize a cpu with memory-mapped output to
         that window.
         """
         self.window = c
-        self.RAM = MemoryMap(self.cells, [(self.vram, self.curses_write)])
+        # the vram addresses written to since the last flush, the color pairs
+        # made so far, keyed by (foreground, background), and when we last
+        # flushed.
+        self.dirty = set()
+        self.pairs = {}
+        self.flushed = 0
+        try:
+            self.colors = curses.has_colors()
+        except curses.error:
+            self.colors = False
+        self.RAM = MemoryMap(self.cells, [
+            (self.vram, self.curses_write),
+            (self.keyring_region, self.keyring_write),
+        ], [
+            (self.keyring_region, self.keyring_read),
+        ])
         # copy my own `registers` dict.
         self.registers = self._registers.copy()
 
         # Prepare the input pointer.
         self.RAM[0x9010] = 0x9000
 
-
     def receive_input(self, ch):
+        "Handle some input from the terminal."
+        self.keyboard_input(ch)
+
+    def curses_write(self, position, value):
+        """This gets called whenever a cell within the vram is changed. It just
+        notes the cell; flush draws it.
         """
-        Handle some input from the terminal.
-        """
+        self.dirty.add(position)
 
-        self.input_buffer.append(ch)
-        index = 0
-        pointer = self.RAM[0x9010]
-        while not self.RAM[pointer]:
-            self.RAM[pointer] = self.input_buffer[index]
-            index += 1
-            pointer += 1
-            if pointer <= 0x9010:
-                pointer = 0x9000
-        self.RAM[0x9010] = pointer
-        self.input_buffer = self.input_buffer[index:]
+    def attribute(self, color):
+        """Turn the eight color bits of a cell (ffffbbbb) into curses
+        attributes, making a new color pair the first time a combination of
+        colors is used. A color of zero -- black on black -- is what plain
+        ascii looks like, so that gets the terminal's default colors.
+        """
+        if not color or not self.colors:
+            return curses.A_NORMAL
+        foreground, background = color >> 4, color & 0b00001111
+        # curses only has eight colors; the highlight bit of the foreground
+        # turns into bold.
+        attribute = curses.A_BOLD if foreground & 0b1000 else curses.A_NORMAL
+        key = foreground & 0b0111, background & 0b0111
+        pair = self.pairs.get(key)
+        if pair == None:
+            if len(self.pairs) + 1 >= curses.COLOR_PAIRS:
+                return attribute
+            pair = len(self.pairs) + 1
+            curses.init_pair(pair, self.curses_colors[key[0]],
+                    self.curses_colors[key[1]])
+            self.pairs[key] = pair
+        return attribute | curses.color_pair(pair)
 
+    def flush(self):
+        "Draw every cell that's changed since the last flush, all at once."
+        self.flushed = time.time()
+        if not self.dirty:
+            return
+        for position in self.dirty:
+            value = self.RAM[position]
+            # low seven bits is the character in ascii, so mask away all the
+            # rest. the high byte is the color.
+            char = value & 0b0000000001111111
+            # subtract the lower bound of the vram the given position
+            offset = position - self.vram[0]
+            # calculate the x, y position.
+            x = offset % self.width
+            y = offset // self.width
+            # curses won't draw control characters in place.
+            if char < 0x20 or char == 0x7f:
+                char = ord(" ")
+            try:
+                self.window.addch(y, x, char, self.attribute(value >> 8))
+            except curses.error:
+                # writing the bottom right corner moves the cursor off the
+                # window, which curses complains about after drawing it.
+                pass
+        self.dirty.clear()
+        # update the virtual screen, and then the real one once.
+        self.window.noutrefresh()
+        curses.doupdate()
 
-    def curses_write(self, position, value):
-        "This gets called whenever a cell within the vram is changed."
-        # low seven bits is the character in ascii, so mask away all the rest
-        # the rest is unspec'd color data probably.
-        char = chr(value & 0b0000000001111111)
-        # subtract the lower bound of the vram the given position
-        offset = position - self.vram[0]
-        # calculate the x, y position.
-        x = offset % self.width
-        y = offset // self.width
-        # and then add the character
-        self.window.addch(y, x, char)
-        self.window.refresh()
+    def tick(self):
+        "Flush, if it's been long enough since the last time."
+        if time.time() - self.flushed >= 1.0 / self.fps:
+            self.flush()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from sixteen.words import as_opcode, from_hex
+from sixteen.words import tables, from_hex
 from sixteen.utilities import OpcodeError
 from sixteen import boxes
 from functools import wraps
@@ -79,7 +79,7 @@ class DCPU16(object):
         self.RAM[n] = value
 
     def parse_instruction(self, word, address=None):
-        o, a_code, b_code = as_opcode(word)
+        o, a_code, b_code = tables.opcode[word], tables.a[word], tables.b[word]
         # if this is a special opcode...
         if o == 0x00:
             # arguments are switched for the special opcodes
@@ -158,12 +158,9 @@ class DCPU16(object):
         def op(self, a, b):
             boolean = fn(self, a, b)
             if not boolean:
-                # get the arguments from the next word
-                _, n_a, n_b = as_opcode(self.RAM[self.registers["PC"]])
-                # compute the length of the next word's values.
-                length = self.values[n_a].consumes + self.values[n_b].consumes
-                # jump ahead that many words.
-                self.registers["PC"] += 1 + length
+                # jump ahead the length of the next instruction.
+                self.registers["PC"] += tables.length[
+                        self.RAM[self.registers["PC"]]]
         return op
 
     @IFX
@@ -3,7 +3,7 @@
 
 import readline
 from functools import wraps
-from sixteen.words import as_opcode
+from sixteen.dis import decode
 from sixteen.utilities import OpcodeError
 
 
@@ -101,16 +101,13 @@ class Debugger(object):
 
 	def dis(self, addr):
 		"Given an address, disassemble the word there."
-		word = self.cpu.RAM[self.parse_number(addr)]
+		address = self.parse_number(addr)
 		try:
-			# parse the opcodes and values out of the word
-			opcode, values = self.cpu.parse_instruction(word)
-			# print each opcode and its arguments
-			assembly = "%s %s" % (opcode, ", ".join([v.dis for v in values]))
+			# decode the instruction there, without touching the cpu
+			return str(decode(self.cpu.RAM, address))
 		# if there's an OpcodeError, it's a DAT instruction.
 		except OpcodeError:
-			assembly = "DAT 0x%04x" % word
-		return assembly
+			return "DAT 0x%04x" % self.cpu.RAM[address]
 
 	def jump(self, pc):
 		"Move the PC to a given address."
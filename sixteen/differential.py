@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Differential testing: run the same program on the reference interpreter
+and on some other engine, and make sure they agree bit for bit.
+
+An engine is anything that can be constructed without arguments and looks like
+a DCPU16: it has "RAM", "registers" and "cycle". If it has a "run_block"
+method, that gets called instead of "cycle" and should return the number of
+instructions it ran; the reference runs that many and then they're compared.
+
+After each step, only the registers and the memory either of them wrote to
+get compared, which is a lot less than the whole 64K. Writes get noticed
+through a MemoryMap's write callbacks or, if RAM is a plain list, by swapping
+in a WrittenRAM. An engine that writes to memory some other way gets caught
+by one last comparison of the whole of it at the end.
+"""
+
+import os
+import random
+from collections import deque
+from multiprocessing import Pool
+from sixteen.dcpu16 import DCPU16
+from sixteen.dis import decode
+from sixteen.fuzzer import parse_program
+from sixteen.memorymap import MemoryMap
+from sixteen.utilities import OpcodeError
+
+
+def memory(cpu):
+    "Return a cpu's memory as a plain list, without going through callbacks."
+    if isinstance(cpu.RAM, MemoryMap):
+        return cpu.RAM._map
+    return cpu.RAM
+
+
+class WrittenRAM(list):
+    """A list that remembers the addresses that get assigned to in
+    "written", until somebody clears it.
+    """
+    def __init__(self, words=()):
+        list.__init__(self, words)
+        self.written = set()
+
+    def __setitem__(self, n, value):
+        if isinstance(n, slice):
+            self.written.update(xrange(*n.indices(len(self))))
+        else:
+            self.written.add(n % len(self))
+        list.__setitem__(self, n, value)
+
+    def __setslice__(self, start, end, value):
+        self[max(0, start):max(0, end)] = value
+
+
+class Divergence(object):
+    """Where two engines stopped agreeing. "step" is how many steps in it
+    happened, "pc" is where the step started, "differences" is a list of
+    (what, reference, other) triples and "history" the last few PCs.
+    """
+    def __init__(self, program, step, pc, differences, history, ram):
+        self.program = program
+        self.step = step
+        self.pc = pc
+        self.differences = differences
+        self.history = list(history)
+        self.context = [self.disassemble(ram, a) for a in self.history]
+
+    @staticmethod
+    def disassemble(ram, address):
+        try:
+            return address, str(decode(ram, address))
+        except OpcodeError:
+            return address, "DAT 0x%04x" % ram[address]
+
+    def __str__(self):
+        lines = ["diverged at step %d (PC 0x%04x):" % (self.step, self.pc)]
+        for what, reference, other in self.differences:
+            lines.append("    %s: reference %s, engine %s" % (what,
+                reference, other))
+        for address, assembly in self.context:
+            marker = ">>" if address == self.pc else "  "
+            lines.append("  %s 0x%04x: %s" % (marker, address, assembly))
+        return "\n".join(lines)
+
+
+class Differential(object):
+    """Compare an engine against the reference interpreter. "context" is how
+    many of the last instructions to keep for divergence reports.
+    """
+    reference = DCPU16
+    context = 8
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def load(self, program):
+        "Make a reference cpu and an engine cpu with a program loaded."
+        cpus = self.reference(), self.engine()
+        for cpu in cpus:
+            cpu.RAM[:len(program)] = program
+        return cpus
+
+    def watch(self, cpu):
+        """Start noticing which addresses a cpu writes to, and return the
+        set they'll get added to.
+        """
+        if isinstance(cpu.RAM, MemoryMap):
+            written = set()
+            cpu.RAM.register_write((0, cpu.RAM.number),
+                    lambda n, value: written.add(n))
+            return written
+        cpu.RAM = WrittenRAM(cpu.RAM)
+        return cpu.RAM.written
+
+    def outcome(self, fn, *args):
+        "Call a function and return (result, exception type)."
+        try:
+            return fn(*args), None
+        except Exception as e:
+            return None, type(e)
+
+    def differences(self, reference, other, ref_error, other_error,
+            addresses=None):
+        """Return a list of everything that differs between two cpus,
+        looking at only the given addresses of memory, or all of it if that's
+        None.
+        """
+        found = []
+        if ref_error != other_error:
+            found.append(("exception", ref_error and ref_error.__name__,
+                other_error and other_error.__name__))
+        for name in sorted(reference.registers):
+            r, o = reference.registers[name], other.registers.get(name)
+            if r != o:
+                found.append((name, "%04x" % r, o if o == None else "%04x" % o))
+        ram, other_ram = memory(reference), memory(other)
+        if addresses == None:
+            if ram == other_ram:
+                return found
+            addresses = xrange(len(ram))
+        for address in sorted(addresses):
+            if ram[address] != other_ram[address]:
+                found.append(("[0x%04x]" % address, "%04x" % ram[address],
+                    "%04x" % other_ram[address]))
+        return found
+
+    def compare(self, program, limit=1000, full=True):
+        """Run a program on both for up to "limit" instructions and return the
+        first Divergence, or None if they agreed the whole way. Unless "full"
+        is False, all of memory gets compared once they're done, in case
+        either wrote somewhere without it being noticed.
+        """
+        reference, other = self.load(program)
+        ref_written, other_written = self.watch(reference), self.watch(other)
+        history = deque(maxlen=self.context)
+        pc = reference.registers["PC"]
+        step = 0
+        executed = 0
+        while executed < limit:
+            pc = reference.registers["PC"]
+            history.append(pc)
+            block = getattr(other, "run_block", None)
+            if block != None:
+                count, other_error = self.outcome(block)
+                count = count or 1
+            else:
+                count = 1
+                _, other_error = self.outcome(other.cycle)
+            ref_error = None
+            for _ in xrange(count):
+                _, ref_error = self.outcome(reference.cycle)
+                if ref_error != None:
+                    break
+            step += 1
+            executed += count
+            found = self.differences(reference, other, ref_error, other_error,
+                    ref_written | other_written)
+            ref_written.clear()
+            other_written.clear()
+            if found:
+                return Divergence(program, step, pc, found, history,
+                        memory(reference))
+            if ref_error != None:
+                break
+        if full:
+            found = self.differences(reference, other, None, None)
+            if found:
+                return Divergence(program, step, pc, found, history,
+                        memory(reference))
+        return None
+
+
+def _compare((engine, program, limit)):
+    "Compare one program, in a worker process."
+    divergence = Differential(engine).compare(program, limit)
+    if divergence != None:
+        return str(divergence)
+
+
+def check(engine, programs, limit=1000, processes=None):
+    """Compare an engine against the reference on every program, in parallel,
+    and return a list of (program, report) pairs for the ones that diverged.
+    """
+    programs = list(programs)
+    pool = Pool(processes)
+    try:
+        reports = pool.map(_compare,
+                [(engine, tuple(p), limit) for p in programs])
+    finally:
+        pool.close()
+        pool.join()
+    return [(p, r) for p, r in zip(programs, reports) if r != None]
+
+
+def generate(count, seed=None, words=16):
+    "Generate a number of random programs, reproducibly."
+    r = random.Random(seed)
+    for _ in xrange(count):
+        yield tuple(r.randrange(0x10000) for _ in
+                xrange(r.randint(1, words)))
+
+
+def corpus(directory):
+    "Iterate over the programs in a fuzzer's corpus directory."
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".hex"):
+            with open(os.path.join(directory, name)) as f:
+                yield parse_program(f.read())
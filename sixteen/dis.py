@@ -1,23 +1,156 @@
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
 from sixteen.dcpu16 import DCPU16
+from sixteen.words import tables, value_lengths
 from sixteen.utilities import OpcodeError
 
 
+registers = ["A", "B", "C", "X", "Y", "Z", "I", "J"]
+
+
+def operand_template(code):
+    """Return a format string for a value code; the ones that consume a next
+    word have a place to put it.
+    """
+    if code < 0x08:
+        return registers[code]
+    elif code < 0x10:
+        return "[%s]" % registers[code - 0x08]
+    elif code < 0x18:
+        return "[0x%%04x + %s]" % registers[code - 0x10]
+    elif code < 0x1e:
+        return ["POP", "[SP]", "PUSH", "SP", "PC", "O"][code - 0x18]
+    elif code == 0x1e:
+        return "[0x%04x]"
+    elif code == 0x1f:
+        return "0x%04x"
+    else:
+        return "0x%04x" % (code - 0x20)
+
+
+# the templates for all 64 value codes.
+operand_templates = tuple(operand_template(c) for c in xrange(0x40))
+
+# the mnemonic for each basic opcode, and then for each special opcode.
+mnemonics = tuple(DCPU16.opcodes.get(o) for o in xrange(0x10))
+special_mnemonics = tuple(DCPU16.special_opcodes.get(o) for o in xrange(0x40))
+
+
+def operand(code, next_word=None):
+    "Given a value code and its next word (if any), disassemble it."
+    if value_lengths[code]:
+        return operand_templates[code] % next_word
+    return operand_templates[code]
+
+
+class Instruction(namedtuple("Instruction", "address op codes operands words")):
+    """A single decoded instruction. "codes" are its value codes, in the order
+    the CPU handles them; "operands" are the next words they consumed, or
+    None for the ones that didn't consume any.
+    """
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.words)
+
+    @property
+    def next(self):
+        "The address of the instruction after this one."
+        return self.address + len(self.words)
+
+    def literal(self, n):
+        "Return the literal value of the nth argument, or None."
+        code, word = self.codes[n], self.operands[n]
+        if code == 0x1f:
+            return word
+        elif code >= 0x20:
+            return code - 0x20
+
+    def __str__(self):
+        return "%s %s" % (self.op, ", ".join(operand(c, w) for c, w in
+            zip(self.codes, self.operands)))
+
+
+def decode(words, address):
+    """Decode the instruction at the given address of a sequence of words,
+    raising an OpcodeError if there isn't one.
+    """
+    size = len(words)
+    word = words[address]
+    o, a, b = tables.opcode[word], tables.a[word], tables.b[word]
+    if not tables.valid[word]:
+        raise OpcodeError(o, address)
+    elif o == 0x00:
+        # arguments are switched for the special opcodes
+        op = special_mnemonics[a]
+        codes = (b,)
+    else:
+        op = mnemonics[o]
+        codes = (a, b)
+    operands = []
+    consumed = [word]
+    for code in codes:
+        if value_lengths[code]:
+            n = address + len(consumed)
+            # a whole memory wraps around like the PC does; anything shorter
+            # counts as zeroes past the end, the same as in disassemble.
+            if size == 0x10000:
+                n %= size
+            next_word = words[n] if n < size else 0
+            consumed.append(next_word)
+            operands.append(next_word)
+        else:
+            operands.append(None)
+    return Instruction(address, op, codes, tuple(operands), tuple(consumed))
+
+
+def disassemble(words, start=0):
+    """Given any sequence of words (a list, an array, a cpu's RAM), iterate
+    over (assembly, address) pairs for the code from "start" until the rest of
+    it is zeroes. Invalid words become DATs. This doesn't need a cpu at all;
+    it's just a few table lookups and a string format per instruction.
+    """
+    end = len(words)
+    while end > start and not words[end - 1]:
+        end -= 1
+    opcodes, a_s, b_s = tables.opcode, tables.a, tables.b
+    valid, templates = tables.valid, operand_templates
+    address = start
+    while address < end:
+        word = words[address]
+        if not valid[word]:
+            yield "DAT 0x%04x" % word, address
+            address += 1
+            continue
+        o, a, b = opcodes[word], a_s[word], b_s[word]
+        if o == 0x00:
+            op, codes = special_mnemonics[a], (b,)
+        else:
+            op, codes = mnemonics[o], (a, b)
+        n = address + 1
+        args = []
+        for code in codes:
+            if value_lengths[code]:
+                # words past the end of the sequence count as zeroes
+                args.append(templates[code] % (words[n] if n < len(words)
+                    else 0))
+                n += 1
+            else:
+                args.append(templates[code])
+        yield "%s %s" % (op, ", ".join(args)), address
+        address = n
+
+
 class Disassembler(DCPU16):
     "A subclass of the DCPU16 that disassembles."
     def dis(self):
         "Return an iterator over the code in memory, yielding it disassembled."
-        # until the rest of the RAM is 0x0000
-        while any(self.RAM[self.registers["PC"]:]):
-            address = self.registers["PC"]
-            next_word = self.get_next()
-            try:
-                # parse the opcodes and values out of the next word
-                opcode, values = self.parse_instruction(next_word)
-                # print each opcode and its arguments
-                assembly = "%s %s" % (opcode, ", ".join([v.dis for v in values]))
-            # if there's an OpcodeError, it's a DAT instruction.
-            except OpcodeError:
-                assembly = "DAT 0x%04x" % next_word
-            yield assembly, address
+        return disassemble(self.RAM, self.registers["PC"])
+
+    def traverse(self, *entries):
+        """Follow the flow of control from the given entry points (or from
+        address 0) and return a ControlFlowGraph of everything reachable.
+        """
+        from sixteen.cfg import ControlFlowGraph
+        return ControlFlowGraph(self.RAM, entries or (0,))
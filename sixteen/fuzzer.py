@@ -1,14 +1,357 @@
 # -*- coding: utf-8 -*-
 
+import os
+import random
+import pickle
+import shutil
+from bisect import insort
+from hashlib import sha1
+from multiprocessing import Pool
 from itertools import permutations
-from sixteen.dis import Disassembler
+from sixteen.dcpu16 import DCPU16
+from sixteen.dis import disassemble
+from sixteen.words import tables, from_opcode
+from sixteen.utilities import OpcodeError
 
 
 def fuzzer(words):
     "Generate and yield every possible program up to a given amount of words."
     for code in permutations(xrange(0x10000), words):
         # disassemble the code
-        d = Disassembler()
-        d[:words] = code
-        dis = " / ".join(o for o, _ in d.dis())
+        dis = " / ".join(o for o, _ in disassemble(code))
         yield code, dis
+
+
+def format_program(program):
+    "Format a program as an ASCII hex dump, like sixteen-asm --hex does."
+    return " ".join("%04x" % w for w in program)
+
+
+def parse_program(text):
+    "Parse an ASCII hex dump with possible whitespace into a tuple of words."
+    return tuple(int(w, base=16) for w in text.split())
+
+
+class CoverageFuzzer(object):
+    """Mutate a corpus of programs, run each one on a single reusable machine
+    and keep the ones that reach something new. Coverage is a set of
+    features: the opcodes executed, the value codes used, the edges between
+    successive PCs and whether each opcode left O set or clear.
+
+    Anything other than an OpcodeError (which is just how programs end) is a
+    finding, as is a register ending up outside of sixteen bits.
+
+    If it's given a directory, the corpus gets saved there, one hex dump per
+    program, and findings get appended to "findings.txt" in it. Every so
+    often, the number of runs and the state of the random number generator
+    get checkpointed there too, so a fuzzer made with the same directory later
+    picks up exactly where this one stopped.
+    """
+    # the machine programs get run on.
+    machine = DCPU16
+    # how many instructions to run each program for.
+    cycle_limit = 64
+    # the longest program we'll make.
+    max_words = 16
+    # how many runs between checkpoints.
+    checkpoint_every = 500
+
+    def __init__(self, directory=None, seed=None):
+        self.directory = directory
+        self.random = random.Random(seed)
+        self.cpu = self.machine()
+        self._blank = [0x0000] * len(self.cpu.RAM)
+        # every feature we've seen, and the features each program reaches.
+        self.coverage = set()
+        self.corpus = {}
+        # the programs in the corpus, sorted, so choosing one is reproducible
+        self.programs = []
+        self.findings = []
+        self.runs = 0
+        if directory != None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.load()
+            self.restore()
+
+    def reset(self, program):
+        "Put the machine back to its initial state with a program loaded."
+        cpu = self.cpu
+        cpu.RAM[:] = self._blank
+        cpu.RAM[:len(program)] = program
+        cpu.registers = cpu._registers.copy()
+        cpu.cycles = 0
+
+    def run(self, program):
+        """Run a program and return the set of features it covers and an error
+        string, or None if nothing went wrong.
+        """
+        self.reset(program)
+        cpu = self.cpu
+        features = set()
+        error = None
+        opcodes, a_s, b_s = tables.opcode, tables.a, tables.b
+        for _ in xrange(self.cycle_limit):
+            pc = cpu.registers["PC"]
+            try:
+                word = cpu.RAM[pc]
+                op, args = cpu.cycle()
+            except OpcodeError:
+                break
+            except Exception as e:
+                error = "%s at 0x%04x: %s" % (type(e).__name__, pc, e)
+                break
+            features.add(("op", op))
+            if opcodes[word]:
+                features.add(("a", a_s[word]))
+            else:
+                # in a special instruction, "a" is the special opcode and
+                # "b" is the operand.
+                features.add(("special", a_s[word]))
+            features.add(("b", b_s[word]))
+            features.add(("edge", pc, cpu.registers["PC"]))
+            features.add(("O", op, bool(cpu.registers["O"])))
+        if error == None:
+            for name, value in cpu.registers.items():
+                if not 0 <= value <= 0xffff:
+                    error = "register %s out of range: %r" % (name, value)
+                    break
+        return features, error
+
+    def mutate(self, program):
+        "Return a randomly mutated copy of a program."
+        r = self.random
+        words = list(program) or [0x0000]
+        strategy = r.randrange(6)
+        n = r.randrange(len(words))
+        if strategy == 0:
+            # flip a bit
+            words[n] ^= 1 << r.randrange(16)
+        elif strategy == 1:
+            # a completely random word
+            words[n] = r.randrange(0x10000)
+        elif strategy == 2:
+            # a random valid basic instruction
+            words[n] = from_opcode(r.randrange(1, 0x10), r.randrange(0x40),
+                    r.randrange(0x40))
+        elif strategy == 3 and len(words) < self.max_words:
+            words.insert(n, r.randrange(0x10000))
+        elif strategy == 4 and len(words) > 1:
+            del words[n]
+        elif self.programs:
+            # splice in part of another program
+            other = r.choice(self.programs)
+            words = words[:n] + list(other[r.randrange(len(other) + 1):])
+        return tuple(words[:self.max_words])
+
+    def step(self):
+        """Mutate something from the corpus (or make something up, if it's
+        empty), run it and keep it if it reached anything new. Return the
+        program and the error, if any.
+        """
+        if self.programs:
+            parent = self.random.choice(self.programs)
+        else:
+            parent = tuple(self.random.randrange(0x10000) for _ in
+                    xrange(self.random.randint(1, self.max_words)))
+        program = self.mutate(parent)
+        features, error = self.run(program)
+        self.runs += 1
+        if not features <= self.coverage:
+            self.coverage |= features
+            self.add(program, features)
+        if error != None:
+            self.found(program, error)
+        if self.directory != None and self.runs % self.checkpoint_every == 0:
+            self.checkpoint()
+        return program, error
+
+    def fuzz(self, runs):
+        "Take a number of steps and yield every finding."
+        for _ in xrange(runs):
+            program, error = self.step()
+            if error != None:
+                yield program, error
+        if self.directory != None:
+            self.checkpoint()
+
+    def add(self, program, features):
+        "Add a program to the corpus, saving it if there's a directory."
+        if program not in self.corpus:
+            insort(self.programs, program)
+        self.corpus[program] = features
+        if self.directory != None:
+            with open(self.path(program), "w") as f:
+                f.write(format_program(program) + "\n")
+
+    def found(self, program, error):
+        "Record a finding."
+        self.findings.append((program, error))
+        if self.directory != None:
+            with open(os.path.join(self.directory, "findings.txt"), "a") as f:
+                f.write("%s ; %s\n" % (format_program(program), error))
+
+    def path(self, program):
+        "The path a program in the corpus gets saved to."
+        name = sha1(format_program(program)).hexdigest()[:16]
+        return os.path.join(self.directory, name + ".hex")
+
+    def load(self):
+        "Load (and re-run) every program saved in the directory."
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".hex"):
+                with open(os.path.join(self.directory, name)) as f:
+                    program = parse_program(f.read())
+                features, _ = self.run(program)
+                self.coverage |= features
+                self.corpus[program] = features
+        self.programs = sorted(self.corpus)
+
+    def checkpoint(self):
+        """Save the number of runs, the random number generator's state, the
+        programs in the corpus and how much of findings.txt there is,
+        atomically.
+        """
+        path = os.path.join(self.directory, "checkpoint")
+        findings = os.path.join(self.directory, "findings.txt")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump({
+                "runs": self.runs,
+                "random": self.random.getstate(),
+                "programs": self.programs,
+                "findings": (os.path.getsize(findings)
+                    if os.path.exists(findings) else 0),
+            }, f, 2)
+        os.rename(path + ".tmp", path)
+
+    def restore(self):
+        """Pick up from the last checkpoint in the directory, if there is one.
+        Programs that were added after it get dropped, and so do findings,
+        since they'll be found again.
+        """
+        path = os.path.join(self.directory, "checkpoint")
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        self.runs = state["runs"]
+        self.random.setstate(state["random"])
+        kept = set(state["programs"])
+        for program in list(self.corpus):
+            if program not in kept:
+                self.discard(program)
+        self.coverage = set().union(*self.corpus.values())
+        findings = os.path.join(self.directory, "findings.txt")
+        if "findings" in state and os.path.exists(findings):
+            with open(findings, "r+") as f:
+                f.truncate(state["findings"])
+
+    def discard(self, program):
+        "Remove a program from the corpus and the directory."
+        del self.corpus[program]
+        self.programs.remove(program)
+        if self.directory != None and os.path.exists(self.path(program)):
+            os.remove(self.path(program))
+
+    def minimize(self):
+        """Shrink the corpus to the smallest program that reaches each
+        feature, deleting the rest from the directory.
+        """
+        best = {}
+        for program, features in self.corpus.iteritems():
+            for feature in features:
+                kept = best.get(feature)
+                if kept == None or (len(program), program) < (len(kept), kept):
+                    best[feature] = program
+        keep = set(best.itervalues())
+        for program in list(self.corpus):
+            if program not in keep:
+                self.discard(program)
+        if self.directory != None:
+            self.checkpoint()
+        return len(self.corpus)
+
+
+def shard_directory(directory, shard):
+    "The directory a shard keeps its own corpus in."
+    return os.path.join(directory, "shard-%03d" % shard)
+
+
+def run_shard((directory, seed, shard, runs)):
+    """Run one shard of a sharded fuzz until it's done a total number of runs,
+    resuming from its checkpoint if it has one. Each shard's random number
+    generator is seeded from the seed and the shard number, so it's
+    deterministic. Return the shard number and how many runs it's done.
+    """
+    seed = int(sha1("%s:%d" % (seed, shard)).hexdigest(), 16)
+    path = shard_directory(directory, shard)
+    # without a checkpoint, the shard starts over from its first run and
+    # finds everything again, so whatever it saved before it got killed has
+    # to go too -- or it'd be loaded and change what happens.
+    if (os.path.isdir(path)
+            and not os.path.exists(os.path.join(path, "checkpoint"))):
+        shutil.rmtree(path)
+    f = CoverageFuzzer(path, seed)
+    for _ in f.fuzz(max(0, runs - f.runs)):
+        pass
+    return shard, f.runs
+
+
+def merge(directory, shards, minimize=True):
+    """Merge the corpora and findings of all of the shards into "corpus" and
+    "findings.txt" in the directory, dropping duplicates, and then minimize
+    the merged corpus, unless "minimize" is False. Return the merged
+    CoverageFuzzer.
+    """
+    merged = os.path.join(directory, "corpus")
+    if not os.path.isdir(merged):
+        os.makedirs(merged)
+    findings = set()
+    path = os.path.join(directory, "findings.txt")
+    if os.path.exists(path):
+        with open(path) as f:
+            findings.update(f)
+    for shard in xrange(shards):
+        source = shard_directory(directory, shard)
+        if not os.path.isdir(source):
+            continue
+        for name in os.listdir(source):
+            if name.endswith(".hex"):
+                # names are hashes of the contents, so equal programs end up
+                # in the same file.
+                with open(os.path.join(source, name)) as f:
+                    with open(os.path.join(merged, name), "w") as out:
+                        out.write(f.read())
+            elif name == "findings.txt":
+                with open(os.path.join(source, name)) as f:
+                    findings.update(f)
+    with open(path + ".tmp", "w") as f:
+        f.writelines(sorted(findings))
+    os.rename(path + ".tmp", path)
+    # the merged corpus isn't resumed, so its old checkpoint shouldn't drop
+    # anything that just got merged in.
+    if os.path.exists(os.path.join(merged, "checkpoint")):
+        os.remove(os.path.join(merged, "checkpoint"))
+    fuzzer = CoverageFuzzer(merged)
+    if minimize:
+        fuzzer.minimize()
+    for line in sorted(findings):
+        program, error = line.rstrip("\n").split(" ; ", 1)
+        fuzzer.findings.append((parse_program(program), error))
+    return fuzzer
+
+
+def fuzz_shards(directory, shards, runs, seed=0, processes=None,
+        minimize=True):
+    """Fuzz in a number of deterministic shards of a number of runs each,
+    spread over a pool of processes, and then merge the results (see merge).
+    Killing this and running it again with the same arguments resumes it.
+    """
+    pool = Pool(processes)
+    try:
+        progress = pool.map(run_shard,
+                [(directory, seed, shard, runs) for shard in xrange(shards)])
+    finally:
+        pool.close()
+        pool.join()
+    return progress, merge(directory, shards, minimize)
@@ -2,11 +2,72 @@
 
 
 class LoopDetecting(object):
-    "Ill-informed attempts at solving the halting problem."
+    """Ill-informed attempts at solving the halting problem.
+
+    If memory keeps a count of the writes that changed it (like MemoryMap's
+    "writes"), this catches any loop that isn't making progress: every time
+    the PC goes backwards, the registers get remembered, and if we come back
+    around to exactly the same registers without memory having changed in
+    between, the machine is in the same state it was in before and it'll go
+    around forever. As soon as something else (keyboard input, say) changes
+    memory, it's not looping anymore.
+
+    If the loop read the keyboard (see InputCPU.polled), it's waiting for
+    input rather than halted, and "waiting" gets turned on too. Either way,
+    callers that skip cycles while it's stopped can use fast_forward to keep
+    the cycle count moving as if they had run.
+
+    Otherwise, it only knows about the two usual ways of halting.
+    """
     # this gets turned into True if we suspect the program is looping.
     stop = False
 
+    # and this if it's looping waiting for a key.
+    waiting = False
+
+    # how many states to remember before forgetting them all and starting
+    # over, so that long-running loops don't use up memory.
+    remembered = 4096
+
+    _writes = None
+    _last_pc = -1
+    _last_cycle = -1
+
     def is_looping(self):
+        writes = getattr(self.RAM, "writes", None)
+        if writes == None:
+            return self.is_halting()
+        if writes != self._writes:
+            # memory changed, so whatever we saw before doesn't count.
+            self._writes = writes
+            self._states = set()
+            self.stop = self.waiting = self.polled = False
+        # nothing new to look at unless it's run since we were last asked.
+        if self.stop or self.cycles == self._last_cycle:
+            return self.stop
+        self._last_cycle = self.cycles
+        pc = self.registers["PC"]
+        if pc <= self._last_pc:
+            state = tuple(self.registers.itervalues())
+            if state in self._states:
+                self.stop = True
+                self.waiting = self.polled
+            else:
+                if len(self._states) >= self.remembered:
+                    self._states.clear()
+                self._states.add(state)
+        self._last_pc = pc
+        return self.stop
+
+    def fast_forward(self, count):
+        """Account for some cycles that would've been spent going around the
+        loop, if we're stopped.
+        """
+        if self.stop:
+            self.cycles += count
+
+    def is_halting(self):
+        "Check whether the next instruction is one of the usual halts."
         if self.stop:
             return True
         else:
@@ -24,4 +85,3 @@ class LoopDetecting(object):
                 if first == 0x7dc1 and second == self.registers["PC"]:
                     self.stop = True
             return self.stop
-
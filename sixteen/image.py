@@ -1,7 +1,11 @@
+import struct
+from Queue import Queue
+from threading import Thread
 from PIL import Image
 from sixteen.dcpu16 import DCPU16
-from sixteen.output import OutputCPU
+from sixteen.output import OutputCPU, frame_size, palette, render, glyphs_for
 from sixteen.characters import characters
+from sixteen.utilities import OpcodeError
 
 
 class ImageCPU(DCPU16, OutputCPU):
@@ -15,26 +19,198 @@ class ImageCPU(DCPU16, OutputCPU):
         # list of integers.
         self.RAM = [0x0000] * 0x10000
 
-    def dump(self, path):
-        "Write an image of the current video ram to the given path."
-        # initialize a new pil image.
-        im = Image.new("RGB", (self.char_width * self.width, 
-            self.char_height * self.height))
-        for addr, val in ((a, self.RAM[a]) for a in xrange(*self.vram)):
-            x, y, foreground, background, _, char = self.letter(addr, val)
-            # find the location of the first word that describes this character.
-            location = self.chars[0] + char
-            rows = self.character(self.RAM[location], self.RAM[location + 1])
-            # this is the true (pixel-wise) offsets for x and y
-            offset_x = x * self.char_width
-            offset_y = y * self.char_height
-            for row_num, row in enumerate(rows):
-                for col, pixel in enumerate(row):
-                    coords = ((offset_x + col, offset_y + row_num))
-                    # if the charmap here is 1, put the foreground
-                    if pixel:
-                        im.putpixel(coords, foreground)
-                    # otherwise, put the background.
-                    else:
-                        im.putpixel(coords, background)
-        im.save(path)
+    def image(self, blink=True, border=0):
+        "Return a PIL image of the current video ram."
+        # render the whole frame into one buffer and hand it over at once.
+        return Image.frombytes("RGB", frame_size(border),
+                self.frame(blink, border))
+
+    def dump(self, target, format=None):
+        """Write an image of the current video ram to the given path or
+        file-like object. Without a format, PIL guesses it from the path, and
+        file-like objects get PNGs.
+        """
+        if format == None and not isinstance(target, basestring):
+            format = "PNG"
+        self.image().save(target, format)
+
+    def record(self, path, every=1, **kwargs):
+        """Start recording frames to the given path while this cpu runs; see
+        FrameRecorder.
+        """
+        return FrameRecorder(self, path, every, **kwargs)
+
+
+class GIFWriter(object):
+    """Write an animated GIF a frame at a time. Every frame uses the sixteen
+    DCPU-16 colors, so there's one global color table and each frame is just
+    its palette indices, LZW-compressed.
+    """
+    def __init__(self, f, size):
+        self.f = f
+        width, height = size
+        self.size = size
+        # a header, a screen descriptor with a 16-color global table, and an
+        # extension that makes it loop forever.
+        f.write("GIF89a" + struct.pack("<HHBBB", width, height, 0xb3, 0, 0))
+        f.write("".join(chr(c) for color in palette for c in color))
+        f.write("!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+
+    def frame(self, indices, delay):
+        """Write a frame, given a string of palette indices and how long to
+        show it for, in hundredths of a second.
+        """
+        width, height = self.size
+        self.f.write("!\xf9\x04\x00" + struct.pack("<H", delay) + "\x00\x00")
+        self.f.write("," + struct.pack("<HHHHB", 0, 0, width, height, 0))
+        data = self.lzw(indices)
+        self.f.write("\x04" + "".join(chr(len(data[n:n + 255])) +
+            data[n:n + 255] for n in xrange(0, len(data), 255)) + "\x00")
+
+    def close(self):
+        self.f.write(";")
+        self.f.close()
+
+    @staticmethod
+    def lzw(indices, minimum=4):
+        "LZW-compress a string of palette indices the way GIFs want."
+        clear, end = 1 << minimum, (1 << minimum) + 1
+        out = bytearray()
+        # bits waiting to be written out, least significant first.
+        state = [0, 0]
+
+        def emit(code, size):
+            state[0] |= code << state[1]
+            state[1] += size
+            while state[1] >= 8:
+                out.append(state[0] & 0xff)
+                state[0] >>= 8
+                state[1] -= 8
+
+        def reset():
+            return dict((chr(n), n) for n in xrange(clear)), end + 1, \
+                    minimum + 1
+
+        table, next_code, size = reset()
+        emit(clear, size)
+        prefix = ""
+        for c in indices:
+            string = prefix + c
+            if string in table:
+                prefix = string
+                continue
+            emit(table[prefix], size)
+            if next_code < 4096:
+                table[string] = next_code
+                next_code += 1
+                if next_code > 1 << size and size < 12:
+                    size += 1
+            else:
+                emit(clear, size)
+                table, next_code, size = reset()
+            prefix = c
+        if prefix:
+            emit(table[prefix], size)
+        emit(end, size)
+        if state[1]:
+            out.append(state[0] & 0xff)
+        return str(out)
+
+
+class FrameRecorder(object):
+    """Record the display of a cpu while it runs headless. Every "every"
+    cycles, the display memory (vram, font and background) gets compared to
+    what it was the last time, and if it's different, a frame is captured.
+    Frames get rendered and encoded on a background thread, so the cpu
+    doesn't wait for them.
+
+    If the path ends in ".gif", the frames go into an animated GIF, written
+    as they come, with each frame lasting as long as it did at "rate" cycles
+    per second. Otherwise, the path should have a "%d" in it (like
+    "frames/%05d.png"), and each frame gets its own image.
+    """
+    def __init__(self, cpu, path, every=1, rate=100000, border=0):
+        self.cpu = cpu
+        self.path = path
+        self.every = every
+        self.rate = rate
+        self.border = border
+        self.frames = 0
+        self._last = None
+        self._queue = Queue()
+        self._thread = Thread(target=self._encode)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def capture(self):
+        "Capture a frame if the display has changed; return whether it had."
+        start, end = self.cpu.vram[0], self.cpu.background[1]
+        display = self.cpu.RAM[start:end]
+        if display == self._last:
+            return False
+        self._last = display
+        self.frames += 1
+        self._queue.put((self.cpu.cycles, display))
+        return True
+
+    def run(self, cycles):
+        """Run the cpu for a number of cycles, capturing frames as we go. Stop
+        early (and return False) if it hits an invalid opcode.
+        """
+        cpu, every = self.cpu, self.every
+        self.capture()
+        for _ in xrange(cycles):
+            try:
+                cpu.cycle()
+            except OpcodeError:
+                return False
+            if cpu.cycles % every == 0:
+                self.capture()
+        return True
+
+    def close(self):
+        "Capture the last frame and wait for everything to be written."
+        self.capture()
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _encode(self):
+        "Render and write frames from the queue until we get None."
+        vram = self.cpu.vram[1] - self.cpu.vram[0]
+        chars = vram + self.cpu.chars[1] - self.cpu.chars[0]
+        size = frame_size(self.border)
+        gif = self.path.lower().endswith(".gif")
+        if gif:
+            writer = GIFWriter(open(self.path, "wb"), size)
+            indices = Image.new("P", (1, 1))
+            indices.putpalette([c for color in palette for c in color] * 16)
+        pending = None
+        glyphs = None
+        n = 0
+        while True:
+            item = self._queue.get()
+            if gif and pending != None:
+                # now we know how long the last frame was up for.
+                cycles, im = pending
+                end = item[0] if item != None else cycles + self.rate
+                delay = max(1, int(round(100.0 * (end - cycles) / self.rate)))
+                writer.frame(im.tobytes(), min(delay, 0xffff))
+            if item == None:
+                break
+            cycles, display = item
+            glyphs = glyphs_for(display[vram:chars], glyphs)
+            im = Image.frombytes("RGB", size, render(display[:vram],
+                glyphs.font, display[chars], True, self.border, glyphs))
+            if gif:
+                pending = cycles, im.quantize(palette=indices)
+            else:
+                im.save(self.path % n)
+            n += 1
+        if gif:
+            writer.close()
@@ -1,9 +1,45 @@
 # -*- coding: utf-8 -*-
 
+from collections import deque
+
 
 class InputCPU(object):
+    """The keyboard: a 16-key ring buffer in memory, fed from a queue on the
+    host side that doesn't have a limit. Whenever the program clears a slot,
+    the next key from the queue goes in, so nothing gets dropped however much
+    is typed or pasted or scripted in at once.
+
+    For this to happen by itself, RAM needs to be a MemoryMap with
+    keyring_write as a write callback for keyring_region; otherwise, call
+    refill now and then.
+    """
     # 16 char keyboard ring buffer at 0x9000 - 0x900f
     keyring = (0x9000, 0x900f)
+    # the ring buffer and the pointer right after it, as a range.
+    keyring_region = (0x9000, 0x9011)
+    # the pointer to the last slot a key went into.
+    keypointer = 0x9010
+
+    # this gets turned into True whenever the program reads the keyring.
+    polled = False
+
+    # keys that haven't fit into the ring yet, keys scheduled by replay, and
+    # the (cycle, key) pairs of everything fed in while recording.
+    input_queue = None
+    scheduled = None
+    recording = None
+
+    def keyring_read(self, index):
+        """A read callback for keyring_region that notes that the program has
+        looked at the keyboard.
+        """
+        self.polled = True
+        return self.RAM.peek(index)
+
+    def keyring_write(self, index, value):
+        "A write callback for keyring_region that refills emptied slots."
+        if value == 0 and index < self.keypointer:
+            self.refill()
 
     def keyboard_input(self, key):
         """ Given the ascii code for the key pressed, put it into memory.
@@ -16,14 +52,64 @@ class InputCPU(object):
         > < Rick> it drops input
         > < Rick> if it is, it sets the value to the key and (offset+1)%16
         > < startling> wonderful.
+
+        Except that we don't drop it; it waits in the queue.
         """
-        pointer = self.RAM[0x9010]
-        if not 0x9000 <= pointer < 0x9010:
-            pointer = 0x9000
-        n = pointer + 1
-        if n >= 0x9010:
-            n = 0x9000
-        if self.RAM[n] == 0:
-            self.RAM[n] = key
+        self.feed([key])
+
+    def feed(self, keys):
+        """Queue up a string or a sequence of key codes and put as many of them
+        into the ring as will fit.
+        """
+        if isinstance(keys, basestring):
+            keys = [ord(c) for c in keys]
+        # zero means an empty slot, so it can't be a key.
+        keys = [k for k in keys if k]
+        if self.input_queue == None:
+            self.input_queue = deque()
+        if self.recording != None:
+            self.recording.extend((self.cycles, k) for k in keys)
+        self.input_queue.extend(keys)
+        self.refill()
+
+    def refill(self):
+        "Move keys from the queue into the ring until it's full."
+        queue = self.input_queue
+        if not queue:
+            return
+        # look at memory without making it look like the program polled.
+        peek = getattr(self.RAM, "peek", self.RAM.__getitem__)
+        pointer = peek(self.keypointer)
+        if not self.keyring[0] <= pointer <= self.keyring[1]:
+            pointer = self.keyring[0]
+        while queue:
+            n = pointer + 1
+            if n > self.keyring[1]:
+                n = self.keyring[0]
+            if peek(n) != 0:
+                break
             pointer = n
-        self.RAM[0x9010] = pointer
+            self.RAM[n] = queue.popleft()
+        self.RAM[self.keypointer] = pointer
+
+    def record(self):
+        """Start recording input, and return the recording: a list of (cycle,
+        key) pairs that replay can take.
+        """
+        self.recording = []
+        return self.recording
+
+    def replay(self, recording):
+        """Schedule a recording to be fed back in at the cycles it originally
+        came in at. pump feeds them as they come due.
+        """
+        self.scheduled = deque(sorted(recording))
+
+    def pump(self):
+        "Feed any scheduled keys that are due by now."
+        scheduled = self.scheduled
+        due = []
+        while scheduled and scheduled[0][0] <= self.cycles:
+            due.append(scheduled.popleft()[1])
+        if due:
+            self.feed(due)
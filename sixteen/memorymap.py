@@ -15,6 +15,9 @@ class MemoryMap(object):
 
         Read callbacks work similarly; they get called whenever a item is
         accessed, and must return a value.
+
+        "writes" counts the writes that actually changed something, so
+        comparing it before and after tells you whether memory changed.
         """
         if read == None:
             read = []
@@ -24,6 +27,7 @@ class MemoryMap(object):
         self.write_callbacks = write
         self.number = number
         self._map = [initial] * number
+        self.writes = 0
 
     def __setitem__(self, n, value):
         # if this is a slice object
@@ -39,6 +43,8 @@ class MemoryMap(object):
                 raise IndexError("list index out of range")
             elif n < 0:
                 n = self.number + n
+            if self._map[n] != value:
+                self.writes += 1
             self._map[n] = value
             # check each callback
             for (start, end), callback in self.write_callbacks:
@@ -69,10 +75,26 @@ class MemoryMap(object):
     def __len__(self):
         return self.number
 
+    def load(self, start, words):
+        """Write a run of words starting at an address, all at once and
+        without calling any write callbacks; whoever does this takes care of
+        whatever they would've done.
+        """
+        end = start + len(words)
+        if start < 0 or end > self.number:
+            raise IndexError("list index out of range")
+        if self._map[start:end] != list(words):
+            self.writes += 1
+        self._map[start:end] = words
+
+    def peek(self, n):
+        "Get the value at a given address without calling any read callbacks."
+        return self._map[n]
+
     def register_write(self, (start, end), callback):
         "Register a new write callback."
-        self.write_callbacks.append((start, end), callback)
+        self.write_callbacks.append(((start, end), callback))
 
     def register_read(self, (start, end), callback):
         "Register a new read callback."
-        self.read_callbacks.append((start, end), callback)
+        self.read_callbacks.append(((start, end), callback))
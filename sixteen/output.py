@@ -1,6 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from sixteen.words import bit_iter
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# the bits of every byte, least significant first, which is the order the rows
+# of a character's columns go in.
+byte_bits = [tuple((b >> n) & 1 for n in xrange(8)) for b in xrange(256)]
+
+
+def character(top, bottom):
+    "Turn two sixteen-bit words into a list representing a bitmap."
+    # each byte is a column, so zip them to rearrange them into rows.
+    return zip(byte_bits[top >> 8], byte_bits[top & 0xff],
+            byte_bits[bottom >> 8], byte_bits[bottom & 0xff])
 
 
 class OutputCPU(object):
@@ -14,6 +29,10 @@ class OutputCPU(object):
     vram = (0x8000, 0x8180)
     height, width = (12, 32)
 
+    # the glyph cache: the Glyphs for the font memory the last frame used.
+    # it's made per-cpu, when it's first needed.
+    _glyphs = None
+
     def letter(self, index, value):
         # figure out the number of this from where the vram starts
         offset = index - self.vram[0]
@@ -36,15 +55,27 @@ class OutputCPU(object):
 
     def character(self, top, bottom):
         "Turn two sixteen-bit words into a list representing a bitmap."
-        # organize the bits into columns
-        columns = [
-            [x for x in bit_iter(top >> 8, 8)][::-1],
-            [x for x in bit_iter(top & 0xff, 8)][::-1],
-            [x for x in bit_iter(bottom >> 8, 8)][::-1],
-            [x for x in bit_iter(bottom & 0xff, 8)][::-1],
-        ]
-        # zip them, to rearrange them into rows.
-        return zip(*columns)
+        return character(top, bottom)
+
+    def glyphs(self):
+        """Return the Glyphs for what's in font memory. They only get rebuilt
+        if font memory has changed since the last time they were asked for.
+        """
+        self._glyphs = glyphs_for(self.RAM[self.chars[0]:self.chars[1]],
+                self._glyphs)
+        return self._glyphs
+
+    def glyph(self, char):
+        "Return the bitmap for a character in font memory."
+        return self.glyphs().bitmaps[char]
+
+    def frame(self, blink=True, border=0):
+        """Render the whole display, from this cpu's memory, as a string of
+        RGB bytes. See render.
+        """
+        glyphs = self.glyphs()
+        return render(self.RAM[self.vram[0]:self.vram[1]], glyphs.font,
+                self.RAM[self.background[0]], blink, border, glyphs)
 
     def color(self, bits):
         "Turn a four-bit hrgb color into a three-tuple of r, g, b."
@@ -60,3 +91,117 @@ class OutputCPU(object):
             g += 0x55 
             b += 0x55 
         return r, g, b
+
+
+# the sixteen colors, as (r, g, b) tuples.
+palette = [OutputCPU().color(n) for n in xrange(16)]
+# the pixel size of a cell, and of the display without the border.
+char_width, char_height = 4, 8
+frame_width = OutputCPU.width * char_width
+frame_height = OutputCPU.height * char_height
+
+
+def frame_size(border=0):
+    "The (width, height) of a rendered frame with a border."
+    return frame_width + 2 * border, frame_height + 2 * border
+
+
+class Glyphs(object):
+    """The 128 glyphs of some font memory, for render: "bitmaps" is a list
+    of what character returns for each of them, and "atlas" is the same thing
+    as a (128 glyphs, 8 rows, 4 columns) numpy array. Each gets built the
+    first time it's needed.
+    """
+    def __init__(self, font):
+        self.font = list(font)
+        self._bitmaps = self._atlas = None
+
+    @property
+    def bitmaps(self):
+        if self._bitmaps == None:
+            font = self.font
+            self._bitmaps = [character(font[2 * n], font[2 * n + 1])
+                    for n in xrange(128)]
+        return self._bitmaps
+
+    @property
+    def atlas(self):
+        if self._atlas is None:
+            font = numpy.asarray(self.font, dtype=numpy.uint16).reshape(128, 2)
+            # each byte of font memory is a column of a glyph, least
+            # significant bit at the top.
+            columns = numpy.column_stack([font[:, 0] >> 8, font[:, 0] & 0xff,
+                font[:, 1] >> 8, font[:, 1] & 0xff])
+            self._atlas = ((columns[:, None, :] >> numpy.arange(8)[None, :,
+                None]) & 1).astype(bool)
+        return self._atlas
+
+
+def glyphs_for(font, cached=None):
+    """Return the Glyphs for some font memory: "cached", if that was made
+    from the same words, or else new ones. Fonts hardly ever change, so
+    keeping the last one around saves building them every frame.
+    """
+    font = list(font)
+    if cached != None and cached.font == font:
+        return cached
+    return Glyphs(font)
+
+
+def render(vram, font, background, blink=True, border=0, glyphs=None):
+    """Given the 384 words of vram, the 256 words of font memory and the
+    background color word, render the whole display as a string of RGB
+    bytes, row by row, surrounded by a border of the given width in the
+    background color. If "blink" is False, blinking cells show only their
+    background (that's the off half of the blink). If the Glyphs for the font
+    are already around, pass them as "glyphs".
+
+    This is vectorized with numpy, if it's around.
+    """
+    if numpy != None:
+        return render_array(vram, font, background, blink, border,
+                glyphs).tostring()
+    rgb = ["".join(chr(c) for c in color) for color in palette]
+    glyphs = (glyphs or Glyphs(font)).bitmaps
+    width, height = frame_size(border)
+    edge = rgb[background & 0xf] * border
+    rows = [rgb[background & 0xf] * width] * border
+    for y in xrange(OutputCPU.height):
+        lines = [[edge] for _ in xrange(char_height)]
+        for value in vram[y * OutputCPU.width:(y + 1) * OutputCPU.width]:
+            fg, bg = rgb[value >> 12], rgb[(value >> 8) & 0xf]
+            if not blink and value & 0x80:
+                fg = bg
+            for line, row in zip(lines, glyphs[value & 0x7f]):
+                line.extend(fg if pixel else bg for pixel in row)
+        rows.extend("".join(line) + edge for line in lines)
+    rows.extend([rgb[background & 0xf] * width] * border)
+    return "".join(rows)
+
+
+def render_array(vram, font, background, blink=True, border=0,
+        glyphs=None):
+    """Like render, but return a (height, width, 3) numpy array of bytes.
+    Every step works on the whole display at once: glyphs get gathered from
+    the atlas of the font's Glyphs, colors get looked up in the palette and
+    blinking cells get masked.
+    """
+    vram = numpy.asarray(vram, dtype=numpy.uint16)
+    colors = numpy.array(palette, dtype=numpy.uint8)
+    lit = (glyphs or Glyphs(font)).atlas[vram & 0x7f]
+    if not blink:
+        lit &= ((vram & 0x80) == 0)[:, None, None]
+    foreground = colors[vram >> 12][:, None, None, :]
+    background_colors = colors[(vram >> 8) & 0xf][:, None, None, :]
+    cells = numpy.where(lit[..., None], foreground, background_colors)
+    # (rows, columns, cell rows, cell columns, rgb) -> pixels
+    frame = cells.reshape(OutputCPU.height, OutputCPU.width, char_height,
+            char_width, 3).transpose(0, 2, 1, 3, 4).reshape(frame_height,
+                    frame_width, 3)
+    if not border:
+        return numpy.ascontiguousarray(frame)
+    width, height = frame_size(border)
+    framed = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    framed[:] = colors[background & 0xf]
+    framed[border:border + frame_height, border:border + frame_width] = frame
+    return framed
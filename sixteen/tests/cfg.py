@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.cfg import ControlFlowGraph
+from sixteen.assembler import AssemblyParser
+
+
+class TestControlFlowGraph(unittest.TestCase):
+    def assemble(self, *lines):
+        return AssemblyParser().parse_tree(lines)
+
+    def test_data_is_not_code(self):
+        code = self.assemble(
+            "set pc, start",
+            "dat 0x0000, 0xffff",
+            ":start set a, 1",
+            "sub pc, 1",
+        )
+        cfg = ControlFlowGraph(code)
+        self.assertEquals(sorted(cfg.instructions), [0, 4, 5])
+        self.assertEquals(cfg.labels, {4: "label_0004", 5: "label_0005"})
+        self.assertEquals(list(cfg.listing()), [
+            "SET PC, label_0004",
+            "DAT 0x0000, 0xffff",
+            ":label_0004 SET A, 0x0001",
+            ":label_0005 SUB PC, 0x0001",
+        ])
+
+    def test_branch_blocks(self):
+        code = self.assemble(
+            "ifn a, 0",
+            "set a, 0x30",
+            "set b, 1",
+            "set pc, pop",
+        )
+        cfg = ControlFlowGraph(code)
+        self.assertEquals(sorted(cfg.blocks), [0, 1, 3])
+        self.assertEquals(cfg.blocks[0].exit, "branch")
+        self.assertEquals(cfg.blocks[0].successors, [(1, "fall"), (3, "skip")])
+        self.assertEquals(cfg.blocks[3].exit, "return")
+        self.assertEquals(sorted(cfg.blocks[3].predecessors),
+                [(0, "skip"), (1, "fall")])
+
+    def test_call(self):
+        code = self.assemble(
+            "jsr sub",
+            "sub pc, 1",
+            ":sub set pc, pop",
+        )
+        cfg = ControlFlowGraph(code)
+        self.assertEquals(cfg.blocks[0].exit, "call")
+        self.assertEquals(cfg.labels, {2: "label_0002", 3: "sub_0003"})
+        self.assertEquals(cfg.block_at(2).start, 2)
+
+    def test_invalid(self):
+        code = self.assemble("set a, 1", "dat 0x0000")
+        cfg = ControlFlowGraph(code)
+        self.assertEquals(cfg.invalid, set([1]))
+        self.assertEquals(cfg.blocks[0].exit, "invalid")
+
+    def test_round_trip(self):
+        code = self.assemble(
+            "set a, 0x30",
+            "set [0x1000], 0x20",
+            ":loop sub a, [0x1000]",
+            "ifn a, 0x10",
+            "set pc, loop",
+            "jsr sub",
+            "set pc, crash",
+            "dat 0x1234, 0x5678",
+            ":sub shl x, 4",
+            "set pc, pop",
+            ":crash set pc, crash",
+        )
+        listing = ControlFlowGraph(code).listing()
+        self.assertEquals(AssemblyParser().parse_tree(listing), code)
+
+    def test_small_long_literal(self):
+        # SET A, 0x0003 with the literal in the next word; the assembler
+        # would make that a short literal, so it has to be a DAT.
+        cfg = ControlFlowGraph([0x7c01, 0x0003, 0x85c3])
+        listing = list(cfg.listing())
+        self.assertEquals(listing[0], "DAT 0x7c01, 0x0003 ; SET A, 0x0003")
+        self.assertEquals(AssemblyParser().parse_tree(listing),
+                [0x7c01, 0x0003, 0x85c3])
+
+    def test_call_past_the_end(self):
+        cfg = ControlFlowGraph(self.assemble("set a, 1", "jsr 0x1000"))
+        self.assertEquals(cfg.invalid, set([0x1000, 3]))
+        self.assertEquals(cfg.blocks[0].exit, "invalid")
+        self.assertEquals(cfg.blocks[0].successors, [])
+
+    def test_fall_off_the_end(self):
+        cfg = ControlFlowGraph(self.assemble("set a, 1", "set b, 2"))
+        self.assertEquals(sorted(cfg.instructions), [0, 1])
+        self.assertEquals(cfg.invalid, set([2]))
+        self.assertEquals(cfg.blocks[0].exit, "invalid")
+        self.assertEquals(cfg.blocks[0].predecessors, [])
+
+    def test_operand_past_the_end(self):
+        # SET A, [next word] with the next word missing reads it as zero.
+        cfg = ControlFlowGraph([0x7801])
+        self.assertEquals(cfg.instructions[0].operands, (None, 0))
+        self.assertEquals(cfg.invalid, set([2]))
+
+    def test_whole_memory_wraps(self):
+        ram = [0] * 0x10000
+        ram[0xffff] = 0x7dc1    # SET PC, [next word], which is RAM[0]
+        ram[0] = 0xffff
+        cfg = ControlFlowGraph(ram, [0xffff])
+        self.assertEquals(cfg.instructions[0xffff].words, (0x7dc1, 0xffff))
+        self.assertEquals(cfg.blocks[0xffff].successors, [(0xffff, "jump")])
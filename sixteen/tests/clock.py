@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.clock import Governor
+from sixteen.dcpu16 import DCPU16
+from sixteen.halting import LoopDetecting
+from sixteen.memorymap import MemoryMap
+
+
+class Clock(object):
+    "A clock that only moves when it's told to."
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LoopingCPU(DCPU16, LoopDetecting):
+    def __init__(self):
+        self.registers = self._registers.copy()
+        self.RAM = MemoryMap(self.cells)
+
+
+class TestGovernor(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cpu = DCPU16()
+        # add a, 1 / sub pc, 2 -- count forever
+        self.cpu.RAM[:2] = [0x8402, 0x89c3]
+        self.governor = Governor(self.cpu, 1000, 0.01, self.clock)
+
+    def test_due(self):
+        self.assertEquals(self.governor.due(), 0)
+        self.clock.now += 0.015
+        self.assertEquals(self.governor.due(), 15)
+
+    def test_slice(self):
+        self.clock.now += 0.01
+        wait = self.governor.slice()
+        self.assertEquals(self.cpu.cycles, 10)
+        self.assertAlmostEquals(wait, 0.01)
+        # oversleeping gets made up for in the next slice.
+        self.clock.now += 0.015
+        wait = self.governor.slice()
+        self.assertEquals(self.cpu.cycles, 25)
+
+    def test_burst(self):
+        self.clock.now += 0.1
+        # no more than two slices' worth at once...
+        self.assertEquals(self.governor.slice(), 0)
+        self.assertEquals(self.cpu.cycles, 20)
+        # and the rest comes in the next ones.
+        while self.governor.slice() == 0:
+            pass
+        self.assertEquals(self.cpu.cycles, 100)
+
+    def test_lag(self):
+        self.clock.now += 10
+        while self.governor.due():
+            self.governor.slice()
+        # only a quarter second's worth, not ten seconds'.
+        self.assertEquals(self.cpu.cycles, 250)
+        self.clock.now += 0.01
+        self.assertEquals(self.governor.due(), 10)
+
+    def test_achieved(self):
+        for _ in xrange(110):
+            self.clock.now += 0.01
+            self.governor.slice()
+        self.assertAlmostEquals(self.governor.achieved, 1000.0, delta=10)
+
+    def test_flat_out(self):
+        governor = Governor(self.cpu, None, 0.01, self.clock)
+        # a clock that moves a millisecond every time it's looked at; the
+        # slice looks at it twice per chunk.
+        ticks = iter(xrange(100))
+        governor.clock = lambda: next(ticks) * 0.001
+        self.assertEquals(governor.slice(), 0)
+        self.assertEquals(self.cpu.cycles, 5 * governor.chunk)
+
+    def test_looping_is_skipped(self):
+        cpu = LoopingCPU()
+        # sub pc, 1
+        cpu.RAM[0] = 0x85c3
+        governor = Governor(cpu, 1000, 0.01, self.clock)
+        self.clock.now += 0.02
+        self.assertEquals(governor.execute(governor.due()), 2)
+        self.assertEquals(cpu.cycles, 20)
+
+    def test_skip(self):
+        cpu = LoopingCPU()
+        cpu.RAM[0] = 0x85c3
+        governor = Governor(cpu, 1000, 0.01, self.clock)
+        self.clock.now += 0.01
+        # nothing's known to be stopped until it's been run.
+        self.assertEquals(governor.skip(10), 0)
+        governor.execute(governor.due())
+        self.clock.now += 0.5
+        self.assertEquals(governor.skip(10), 500)
+        self.assertEquals(cpu.cycles, 510)
+        self.clock.now += 100
+        self.assertEquals(governor.skip(10), 10000)
+
+    def test_run(self):
+        self.cpu.RAM[2] = 0x0000
+        self.cpu.RAM[:2] = [0x8402, 0x0000]
+        waits = []
+        self.clock.now += 0.01
+        self.governor.run(sleep=waits.append)
+        self.assertEquals(self.cpu.registers["A"], 1)
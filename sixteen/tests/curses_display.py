@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import curses
+import unittest
+from sixteen.curses_display import TerminalCPU
+
+
+class Window(object):
+    "A stand-in for a curses window that remembers what was drawn on it."
+    def __init__(self):
+        self.cells = {}
+        self.refreshes = 0
+
+    def addch(self, y, x, char, attribute=0):
+        self.cells[x, y] = char, attribute
+
+    def noutrefresh(self):
+        self.refreshes += 1
+
+
+class TestTerminalCPU(unittest.TestCase):
+    def setUp(self):
+        self.window = Window()
+        self.updates = []
+        self._doupdate = curses.doupdate
+        curses.doupdate = lambda: self.updates.append(True)
+        self.cpu = TerminalCPU(self.window)
+
+    def tearDown(self):
+        curses.doupdate = self._doupdate
+
+    def test_writes_wait_for_flush(self):
+        for n in xrange(0x180):
+            self.cpu.RAM[0x8000 + n] = ord("a")
+        self.assertEquals(self.window.cells, {})
+        self.cpu.flush()
+        self.assertEquals(len(self.window.cells), 0x180)
+        self.assertEquals(self.window.cells[31, 11], (ord("a"), 0))
+        # one refresh for the whole screen.
+        self.assertEquals(self.window.refreshes, 1)
+        self.assertEquals(len(self.updates), 1)
+
+    def test_only_changes_are_drawn(self):
+        self.cpu.RAM[0x8021] = ord("b")
+        self.cpu.flush()
+        self.assertEquals(self.window.cells.keys(), [(1, 1)])
+        # nothing changed, so nothing to do.
+        self.cpu.flush()
+        self.assertEquals(self.window.refreshes, 1)
+
+    def test_tick(self):
+        self.cpu.RAM[0x8000] = ord("c")
+        self.cpu.tick()
+        self.assertEquals(self.window.refreshes, 1)
+        self.cpu.RAM[0x8001] = ord("d")
+        # too soon since the last frame.
+        self.cpu.tick()
+        self.assertEquals(self.window.refreshes, 1)
+        self.cpu.flushed = 0
+        self.cpu.tick()
+        self.assertEquals(self.window.refreshes, 2)
+
+    def test_control_characters(self):
+        self.cpu.RAM[0x8000] = 0x0007
+        self.cpu.flush()
+        self.assertEquals(self.window.cells[0, 0], (ord(" "), 0))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.dcpu16 import DCPU16
+from sixteen.memorymap import MemoryMap
+from sixteen.differential import Differential, check, generate
+
+
+class WrongADD(DCPU16):
+    "An engine that forgets to set O on overflow."
+    def ADD(self, a, b):
+        a.set((a.get() + b.get()) & 0xffff)
+
+
+class Blocks(DCPU16):
+    "An engine that runs two instructions at a time."
+    def run_block(self):
+        self.cycle()
+        self.cycle()
+        return 2
+
+
+class Scribbler(DCPU16):
+    "An engine with mapped memory that writes somewhere it shouldn't."
+    def __init__(self):
+        DCPU16.__init__(self)
+        self.RAM = MemoryMap(self.cells)
+
+    def ADD(self, a, b):
+        DCPU16.ADD(self, a, b)
+        self.RAM[0x3000] = 1
+
+
+class Sneaky(DCPU16):
+    "An engine that writes to its memory behind the list's back."
+    def ADD(self, a, b):
+        DCPU16.ADD(self, a, b)
+        list.__setitem__(self.RAM, 0x3000, 1)
+
+
+# set A, 0xffff / set B, 1 / add A, 1 / set C, 2
+program = (0x7c01, 0xffff, 0x8411, 0x8402, 0x8821)
+
+
+class TestDifferential(unittest.TestCase):
+    def test_same(self):
+        self.assertEquals(Differential(DCPU16).compare(program), None)
+
+    def test_blocks(self):
+        self.assertEquals(Differential(Blocks).compare(program), None)
+
+    def test_divergence(self):
+        d = Differential(WrongADD).compare(program)
+        self.assertEquals(d.step, 3)
+        self.assertEquals(d.pc, 0x0003)
+        self.assertEquals(d.differences, [("O", "0001", "0000")])
+        self.assertEquals(d.context, [(0, "SET A, 0xffff"),
+            (2, "SET B, 0x0001"), (3, "ADD A, 0x0001")])
+        self.assertIn(">> 0x0003: ADD A, 0x0001", str(d))
+
+    def test_memory_divergence(self):
+        # set [0x1000], 0xffff / add [0x1000], 1
+        d = Differential(WrongADD).compare((0x7de1, 0x1000, 0xffff, 0x85e2,
+            0x1000))
+        self.assertEquals(d.differences, [("O", "0001", "0000")])
+
+    def test_mapped_memory_divergence(self):
+        d = Differential(Scribbler).compare(program, full=False)
+        self.assertEquals(d.step, 3)
+        self.assertEquals(d.differences, [("[0x3000]", "0000", "0001")])
+
+    def test_unnoticed_writes(self):
+        # only the last look at all of memory catches these.
+        self.assertEquals(Differential(Sneaky).compare(program, full=False),
+                None)
+        d = Differential(Sneaky).compare(program)
+        self.assertEquals(d.differences, [("[0x3000]", "0000", "0001")])
+
+    def test_check(self):
+        programs = list(generate(20, seed=1))
+        self.assertEquals(check(DCPU16, programs, processes=2), [])
+        diverged = check(WrongADD, [program, (0x8411,)], processes=2)
+        self.assertEquals([p for p, _ in diverged], [program])
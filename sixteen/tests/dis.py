@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.dis import Disassembler, disassemble, decode
+from sixteen.utilities import OpcodeError
+
+
+class TestDecode(unittest.TestCase):
+    def test_decode_next_word(self):
+        # SET A, 0x0030
+        i = decode([0x7c01, 0x0030], 0)
+        self.assertEquals(i.op, "SET")
+        self.assertEquals(i.words, (0x7c01, 0x0030))
+        self.assertEquals(i.next, 2)
+        self.assertEquals(str(i), "SET A, 0x0030")
+
+    def test_decode_special(self):
+        # JSR 0x0018
+        i = decode([0x7c10, 0x0018], 0)
+        self.assertEquals(str(i), "JSR 0x0018")
+        self.assertEquals(i.literal(0), 0x0018)
+
+    def test_decode_invalid(self):
+        self.assertRaises(OpcodeError, decode, [0x0000], 0)
+
+
+class TestDisassemble(unittest.TestCase):
+    def assertDisassembles(self, words, expected):
+        self.assertEquals(list(a for a, _ in disassemble(words)), expected)
+
+    def test_quick_example(self):
+        self.assertDisassembles([
+            0x7c01, 0x0030, 0x7de1, 0x1000, 0x0020, 0x7803, 0x1000, 0xc00d,
+            0x7dc1, 0x001a, 0xa861, 0x2161, 0x2000, 0x61c1,
+        ], [
+            "SET A, 0x0030", "SET [0x1000], 0x0020", "SUB A, [0x1000]",
+            "IFN A, 0x0010", "SET PC, 0x001a", "SET I, 0x000a",
+            "SET [0x2000 + I], [A]", "SET PC, POP",
+        ])
+
+    def test_addresses(self):
+        self.assertEquals(list(disassemble([0x7c01, 0x0030, 0x9031])),
+                [("SET A, 0x0030", 0), ("SET X, 0x0004", 2)])
+
+    def test_start(self):
+        self.assertEquals(list(disassemble([0x7c01, 0x0030, 0x9031], 2)),
+                [("SET X, 0x0004", 2)])
+
+    def test_special(self):
+        self.assertDisassembles([0x7c10, 0x0018, 0x8010], ["JSR 0x0018",
+            "JSR 0x0000"])
+
+    def test_dat(self):
+        # invalid words only take up one word each
+        self.assertDisassembles([0x7c00, 0x9031], ["DAT 0x7c00",
+            "SET X, 0x0004"])
+
+    def test_trailing_zeroes(self):
+        self.assertDisassembles([0x9031, 0x0000, 0x0000], ["SET X, 0x0004"])
+
+    def test_missing_next_word(self):
+        self.assertDisassembles([0x7c01], ["SET A, 0x0000"])
+
+    def test_same_as_disassembler(self):
+        code = [0x7c01, 0x0030, 0x85c3, 0x01a1, 0x0d11, 0x8010, 0x6031]
+        d = Disassembler()
+        d.RAM[:len(code)] = code
+        self.assertEquals(list(d.dis()), list(disassemble(code)))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from sixteen.dcpu16 import DCPU16
+from sixteen.fuzzer import CoverageFuzzer, parse_program, format_program
+from sixteen.fuzzer import run_shard, fuzz_shards, shard_directory
+
+
+class BrokenCPU(DCPU16):
+    "A CPU with a deliberately broken XOR."
+    def XOR(self, a, b):
+        raise ValueError("oh no")
+
+
+class BrokenFuzzer(CoverageFuzzer):
+    machine = BrokenCPU
+
+
+class TestCoverageFuzzer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_format(self):
+        self.assertEquals(format_program((0x7c01, 0x0030)), "7c01 0030")
+        self.assertEquals(parse_program("7c01 0030\n"), (0x7c01, 0x0030))
+
+    def test_run(self):
+        f = CoverageFuzzer()
+        # set A, 0xffff / add A, 1
+        features, error = f.run((0x7c01, 0xffff, 0x8402))
+        self.assertEquals(error, None)
+        self.assertIn(("op", "ADD"), features)
+        self.assertIn(("O", "ADD", True), features)
+        self.assertIn(("edge", 0, 2), features)
+
+    def test_special_value_codes(self):
+        f = CoverageFuzzer()
+        # jsr 4 / set a, 1
+        features, error = f.run((0x9010, 0x0000, 0x0000, 0x0000, 0x8401))
+        self.assertIn(("special", 0x01), features)
+        self.assertIn(("b", 0x24), features)
+        self.assertNotIn(("a", 0x01), features)
+        # and both for basic ones.
+        self.assertIn(("a", 0x00), features)
+        self.assertIn(("b", 0x21), features)
+
+    def test_reset(self):
+        f = CoverageFuzzer()
+        # set [0x1000], 1
+        f.run((0x85e1, 0x1000))
+        f.run((0x0000,))
+        self.assertEquals(f.cpu.RAM[0x1000], 0)
+
+    def test_deterministic(self):
+        a = CoverageFuzzer(seed=4)
+        b = CoverageFuzzer(seed=4)
+        list(a.fuzz(100))
+        list(b.fuzz(100))
+        self.assertEquals(a.corpus, b.corpus)
+
+    def test_corpus_on_disk(self):
+        f = CoverageFuzzer(self.directory, seed=1)
+        list(f.fuzz(200))
+        self.assertTrue(f.corpus)
+        again = CoverageFuzzer(self.directory)
+        self.assertEquals(set(again.corpus), set(f.corpus))
+        self.assertEquals(again.coverage, f.coverage)
+
+    def test_minimize(self):
+        f = CoverageFuzzer(self.directory, seed=2)
+        list(f.fuzz(300))
+        coverage = set().union(*f.corpus.values())
+        f.minimize()
+        self.assertEquals(set().union(*f.corpus.values()), coverage)
+        saved = [n for n in os.listdir(self.directory) if n.endswith(".hex")]
+        self.assertEquals(len(saved), len(f.corpus))
+
+    def test_findings(self):
+        f = BrokenFuzzer(self.directory)
+        # xor A, A
+        features, error = f.run((0x000b,))
+        self.assertEquals(error, "ValueError at 0x0000: oh no")
+        f.found((0x000b,), error)
+        with open(os.path.join(self.directory, "findings.txt")) as findings:
+            self.assertEquals(findings.read(),
+                    "000b ; ValueError at 0x0000: oh no\n")
+
+    def test_resume_drops_findings(self):
+        f = BrokenFuzzer(self.directory)
+        f.found((0x000b,), "before")
+        f.checkpoint()
+        # found after the checkpoint, and then killed.
+        f.found((0x000b, 0x0000), "after")
+        BrokenFuzzer(self.directory)
+        with open(os.path.join(self.directory, "findings.txt")) as findings:
+            self.assertEquals(findings.read(), "000b ; before\n")
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def corpus(self, directory):
+        return set(n for n in os.listdir(directory) if n.endswith(".hex"))
+
+    def test_resume(self):
+        first = os.path.join(self.directory, "first")
+        second = os.path.join(self.directory, "second")
+        self.assertEquals(run_shard((first, 3, 0, 400)), (0, 400))
+        # stop halfway, and then pick up where it left off
+        run_shard((second, 3, 0, 200))
+        self.assertEquals(run_shard((second, 3, 0, 400)), (0, 400))
+        self.assertEquals(self.corpus(shard_directory(first, 0)),
+                self.corpus(shard_directory(second, 0)))
+
+    def test_resume_drops_unsaved(self):
+        f = CoverageFuzzer(self.directory, seed=5)
+        list(f.fuzz(100))
+        corpus = set(f.corpus)
+        # steps after the checkpoint that never got checkpointed
+        for _ in xrange(100):
+            f.step()
+        again = CoverageFuzzer(self.directory)
+        self.assertEquals(again.runs, 100)
+        self.assertEquals(set(again.corpus), corpus)
+
+    def test_shard_starting_over(self):
+        # findings from a shard killed before its first checkpoint.
+        path = shard_directory(self.directory, 0)
+        os.makedirs(path)
+        with open(os.path.join(path, "findings.txt"), "w") as f:
+            f.write("000b ; left over\n")
+        run_shard((self.directory, 3, 0, 10))
+        findings = os.path.join(path, "findings.txt")
+        if os.path.exists(findings):
+            with open(findings) as f:
+                self.assertFalse("left over" in f.read())
+
+    def test_killed_before_checkpoint(self):
+        first = os.path.join(self.directory, "first")
+        second = os.path.join(self.directory, "second")
+        run_shard((first, 3, 0, 300))
+        # a shard that saved some of its corpus and then got killed
+        f = CoverageFuzzer(shard_directory(second, 0), seed=9)
+        for _ in xrange(100):
+            f.step()
+        self.assertEquals(run_shard((second, 3, 0, 300)), (0, 300))
+        self.assertEquals(self.corpus(shard_directory(first, 0)),
+                self.corpus(shard_directory(second, 0)))
+
+    def test_fuzz_shards_without_minimizing(self):
+        progress, merged = fuzz_shards(self.directory, 2, 100, processes=2,
+                minimize=False)
+        union = set()
+        for shard in xrange(2):
+            union |= set(CoverageFuzzer(shard_directory(self.directory,
+                shard)).corpus)
+        self.assertEquals(set(merged.corpus), union)
+
+    def test_fuzz_shards(self):
+        progress, merged = fuzz_shards(self.directory, 2, 100, processes=2)
+        self.assertEquals(sorted(progress), [(0, 100), (1, 100)])
+        union = set()
+        for shard in xrange(2):
+            union |= CoverageFuzzer(shard_directory(self.directory,
+                shard)).coverage
+        self.assertEquals(merged.coverage, union)
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+            "findings.txt")))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.dcpu16 import DCPU16
+from sixteen.halting import LoopDetecting
+from sixteen.memorymap import MemoryMap
+from sixteen.assembler import AssemblyParser
+
+
+class LoopCPU(DCPU16, LoopDetecting):
+    def __init__(self, *lines):
+        DCPU16.__init__(self)
+        self.RAM = MemoryMap(self.cells)
+        code = AssemblyParser().parse_tree(lines)
+        self.RAM[:len(code)] = code
+
+    def run(self, limit=1000):
+        "Run until it's looping, returning the number of cycles it took."
+        for n in xrange(limit):
+            if self.is_looping():
+                return n
+            self.cycle()
+
+
+class TestLoopDetecting(unittest.TestCase):
+    def test_sub_pc(self):
+        cpu = LoopCPU("set a, 1", "sub pc, 1")
+        self.assertEquals(cpu.run(), 3)
+
+    def test_longer_loop(self):
+        cpu = LoopCPU(
+            ":loop set a, 1",
+            "set b, a",
+            "ife b, 1",
+            "set pc, loop",
+        )
+        self.assertNotEquals(cpu.run(), None)
+
+    def test_counting(self):
+        # this loop counts up to 0x100, so it isn't stuck until then
+        cpu = LoopCPU(
+            ":loop add a, 1",
+            "ifn a, 0x100",
+            "set pc, loop",
+            "sub pc, 1",
+        )
+        self.assertTrue(cpu.run() > 0x300)
+        self.assertEquals(cpu.registers["A"], 0x100)
+
+    def test_writing(self):
+        # registers stay the same, but memory doesn't
+        cpu = LoopCPU(":loop add [0x1000], 1", "set pc, loop")
+        self.assertEquals(cpu.run(500), None)
+
+    def test_resume(self):
+        cpu = LoopCPU(
+            ":loop ife [0x9000], 0",
+            "set pc, loop",
+            "set a, [0x9000]",
+            "sub pc, 1",
+        )
+        self.assertNotEquals(cpu.run(), None)
+        # something external changes memory
+        cpu.RAM[0x9000] = 0x61
+        self.assertFalse(cpu.is_looping())
+        cpu.run()
+        self.assertEquals(cpu.registers["A"], 0x61)
+
+    def test_without_write_counts(self):
+        cpu = LoopCPU("set a, 1", "sub pc, 1")
+        cpu.RAM = cpu.RAM[:]
+        cpu.cycle()
+        self.assertTrue(cpu.is_looping())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from sixteen.characters import characters
+
+try:
+    from PIL import Image
+    from sixteen.image import ImageCPU
+except ImportError:
+    ImageCPU = None
+
+
+@unittest.skipIf(ImageCPU == None, "PIL isn't installed")
+class TestImageCPU(unittest.TestCase):
+    def setUp(self):
+        self.cpu = ImageCPU()
+        self.cpu.RAM[self.cpu.chars[0]:self.cpu.chars[1]] = characters
+        for n, value in enumerate([0xf041, 0x1e42, 0x2dc3, 0x0f7f]):
+            self.cpu.RAM[self.cpu.vram[0] + n * 41] = value
+
+    def test_image(self):
+        im = self.cpu.image()
+        self.assertEquals(im.size, (128, 96))
+        self.assertEquals(im.tobytes(), self.cpu.frame())
+
+    def test_dump_file_object(self):
+        f = StringIO()
+        self.cpu.dump(f)
+        f.seek(0)
+        im = Image.open(f)
+        self.assertEquals(im.format, "PNG")
+        self.assertEquals(im.convert("RGB").tobytes(), self.cpu.frame())
+
+    def test_dump_path(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "screen.png")
+            self.cpu.dump(path)
+            im = Image.open(path)
+            self.assertEquals(im.convert("RGB").tobytes(), self.cpu.frame())
+        finally:
+            shutil.rmtree(directory)
+
+
+@unittest.skipIf(ImageCPU == None, "PIL isn't installed")
+class TestFrameRecorder(unittest.TestCase):
+    def setUp(self):
+        from sixteen.assembler import AssemblyParser
+        self.directory = tempfile.mkdtemp()
+        self.cpu = ImageCPU()
+        self.cpu.RAM[self.cpu.chars[0]:self.cpu.chars[1]] = characters
+        # three different screens, with a wait after each.
+        code = AssemblyParser().parse_tree([
+            "set [0x8000], 0xf041",
+            ":screen set i, 0",
+            ":wait add i, 1",
+            "ifn i, 10",
+            "set pc, wait",
+            "add [0x8000], 1",
+            "ifn [0x8000], 0xf044",
+            "set pc, screen",
+            ":end set pc, end",
+        ])
+        self.cpu.RAM[:len(code)] = code
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_png_sequence(self):
+        path = os.path.join(self.directory, "%03d.png")
+        with self.cpu.record(path) as recorder:
+            self.assertTrue(recorder.run(200))
+        # the blank screen, then A, B, C and D; nothing repeated.
+        self.assertEquals(recorder.frames, 5)
+        self.assertEquals(sorted(os.listdir(self.directory)),
+                ["%03d.png" % n for n in range(5)])
+        last = Image.open(path % 4).convert("RGB")
+        self.assertEquals(last.tobytes(), self.cpu.frame())
+
+    def test_every(self):
+        path = os.path.join(self.directory, "%03d.png")
+        with self.cpu.record(path, every=1000) as recorder:
+            recorder.run(200)
+        # just the beginning and the end.
+        self.assertEquals(recorder.frames, 2)
+
+    def test_gif(self):
+        path = os.path.join(self.directory, "screen.gif")
+        with self.cpu.record(path, rate=1000) as recorder:
+            recorder.run(200)
+        im = Image.open(path)
+        frames = []
+        try:
+            while True:
+                frames.append((im.convert("RGB").tobytes(),
+                    im.info["duration"]))
+                im.seek(im.tell() + 1)
+        except EOFError:
+            pass
+        self.assertEquals(len(frames), 5)
+        self.assertEquals(frames[-1][0], self.cpu.frame())
+        # each screen stays up for about 30 cycles, at 1000 cycles a second.
+        self.assertTrue(all(20 <= d <= 40 for _, d in frames[1:-1]))
+
+    def test_invalid_opcode_stops(self):
+        self.cpu.RAM[:2] = [0x7c01, 0x1234]
+        self.cpu.RAM[2] = 0x0000
+        with self.cpu.record(os.path.join(self.directory, "%d.png")) as r:
+            self.assertFalse(r.run(10))
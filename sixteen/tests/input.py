@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.dcpu16 import DCPU16
+from sixteen.input import InputCPU
+from sixteen.halting import LoopDetecting
+from sixteen.memorymap import MemoryMap
+from sixteen.assembler import AssemblyParser
+
+
+class KeyboardCPU(DCPU16, InputCPU, LoopDetecting):
+    def __init__(self, *lines):
+        DCPU16.__init__(self)
+        self.RAM = MemoryMap(self.cells,
+                read=[(self.keyring_region, self.keyring_read)])
+        code = AssemblyParser().parse_tree(lines)
+        self.RAM[:len(code)] = code
+        self.RAM[0x9010] = 0x9000
+
+    def run(self, count):
+        "Run like sixteen-web does, fast-forwarding when it's looping."
+        for n in xrange(count):
+            if self.is_looping():
+                self.fast_forward(count - n)
+                break
+            self.cycle()
+
+
+# wait for a key, put it in A, clear its slot and go back to waiting. the
+# first key goes at 0x9001, after the initial pointer.
+polling = [
+    "set i, 1",
+    ":loop ife [0x9000 + i], 0",
+    "set pc, loop",
+    "set a, [0x9000 + i]",
+    "set [0x9000 + i], 0",
+    "add i, 1",
+    "and i, 0xf",
+    "set pc, loop",
+]
+
+
+class TestInputWait(unittest.TestCase):
+    def test_waiting(self):
+        cpu = KeyboardCPU(*polling)
+        cpu.run(100)
+        self.assertTrue(cpu.stop)
+        self.assertTrue(cpu.waiting)
+
+    def test_halted(self):
+        cpu = KeyboardCPU("set a, 1", "sub pc, 1")
+        cpu.run(100)
+        self.assertTrue(cpu.stop)
+        self.assertFalse(cpu.waiting)
+
+    def test_fast_forward(self):
+        cpu = KeyboardCPU(*polling)
+        cpu.run(100)
+        cpu.run(400)
+        self.assertEquals(cpu.cycles, 500)
+
+    def test_wake_up(self):
+        cpu = KeyboardCPU(*polling)
+        cpu.run(100)
+        cpu.keyboard_input(0x61)
+        self.assertFalse(cpu.is_looping())
+        cpu.run(100)
+        self.assertEquals(cpu.registers["A"], 0x61)
+        self.assertEquals(cpu.registers["I"], 2)
+        self.assertTrue(cpu.waiting)
+
+
+class QueuedCPU(KeyboardCPU):
+    def __init__(self, *lines):
+        KeyboardCPU.__init__(self, *lines)
+        self.RAM.write_callbacks.append((self.keyring_region,
+            self.keyring_write))
+
+
+# read a key, store it at 0x1000 + j, and go back to waiting
+copying = [
+    "set i, 1",
+    ":loop ife [0x9000 + i], 0",
+    "set pc, loop",
+    "set [0x1000 + j], [0x9000 + i]",
+    "set [0x9000 + i], 0",
+    "add i, 1",
+    "and i, 0xf",
+    "add j, 1",
+    "set pc, loop",
+]
+
+
+class TestQueuedInput(unittest.TestCase):
+    def setUp(self):
+        self.cpu = QueuedCPU(*copying)
+
+    def received(self):
+        return "".join(chr(c) for c in self.cpu.RAM[0x1000:0x1000 +
+            self.cpu.registers["J"]])
+
+    def test_ring(self):
+        self.cpu.feed("abc")
+        self.assertEquals(self.cpu.RAM[0x9001:0x9004], [0x61, 0x62, 0x63])
+        self.assertEquals(self.cpu.RAM[0x9010], 0x9003)
+
+    def test_full_ring(self):
+        self.cpu.feed("x" * 20)
+        self.assertEquals(len(self.cpu.input_queue), 4)
+
+    def test_bulk(self):
+        text = "the quick brown fox jumps over the lazy dog. " * 4
+        self.cpu.feed(text)
+        self.cpu.run(5000)
+        self.assertEquals(self.received(), text)
+        self.assertTrue(self.cpu.waiting)
+
+    def test_one_at_a_time(self):
+        for c in "hello, world":
+            self.cpu.keyboard_input(ord(c))
+        self.cpu.run(1000)
+        self.assertEquals(self.received(), "hello, world")
+
+    def test_replay(self):
+        recording = self.cpu.record()
+        self.cpu.feed("ab")
+        self.cpu.run(100)
+        self.cpu.feed("cd")
+        self.assertEquals(recording, [(0, 0x61), (0, 0x62), (100, 0x63),
+            (100, 0x64)])
+        again = QueuedCPU(*copying)
+        again.replay(recording)
+        again.pump()
+        self.assertEquals(len(again.input_queue), 0)
+        self.assertEquals(again.RAM[0x9001:0x9003], [0x61, 0x62])
+        again.cycles = 100
+        again.pump()
+        self.assertEquals(again.RAM[0x9003:0x9005], [0x63, 0x64])
@@ -33,6 +33,14 @@ class TestMemoryMap(unittest.TestCase):
         self.assertEquals(self.memory[0], 12)
         self.assertEquals(self.memory[1], 13)
 
+    def test_writes(self):
+        self.memory[3] = 1
+        self.memory[4] = 2
+        self.assertEquals(self.memory.writes, 2)
+        # writing the same thing again doesn't change anything
+        self.memory[3] = 1
+        self.assertEquals(self.memory.writes, 2)
+
 
 class TestCallbacks(unittest.TestCase):
     def setUp(self):
@@ -55,6 +63,19 @@ class TestCallbacks(unittest.TestCase):
         self.assertNotIn(19, self.my_dict.keys())
         self.assertNotIn(-1, self.my_dict.keys())
 
+    def test_load(self):
+        self.memory.load(3, [1, 2, 3])
+        self.assertEquals(self.my_dict, {})
+        self.assertEquals(self.memory[2:7], [0, 1, 2, 3, 0])
+        self.assertEquals(self.memory.writes, 1)
+        # loading the same thing again doesn't change anything.
+        self.memory.load(3, [1, 2, 3])
+        self.assertEquals(self.memory.writes, 1)
+
+    def test_load_out_of_bounds(self):
+        with self.assertRaises(IndexError):
+            self.memory.load(18, [1, 2, 3])
+
 
 class TestWriteCallbacks(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.dcpu16 import DCPU16
+from sixteen import output
+from sixteen.output import OutputCPU, palette, frame_size, render_array
+from sixteen.characters import characters
+
+
+class FontCPU(DCPU16, OutputCPU):
+    def __init__(self):
+        DCPU16.__init__(self)
+        self.RAM[self.chars[0]:self.chars[1]] = characters
+
+
+class TestCharacter(unittest.TestCase):
+    def setUp(self):
+        self.cpu = FontCPU()
+
+    def test_character(self):
+        # the first character in the default set: a vertical line at the
+        # second column turning right at the fourth row.
+        self.assertEquals(self.cpu.character(0x000f, 0x0808), [
+            (0, 1, 0, 0), (0, 1, 0, 0), (0, 1, 0, 0), (0, 1, 1, 1),
+            (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0),
+        ])
+
+    def test_rows_and_columns(self):
+        rows = self.cpu.character(0x8001, 0x0280)
+        self.assertEquals(len(rows), 8)
+        self.assertEquals(rows[0], (0, 1, 0, 0))
+        self.assertEquals(rows[1], (0, 0, 1, 0))
+        self.assertEquals(rows[7], (1, 0, 0, 1))
+
+    def test_glyph(self):
+        self.assertEquals(self.cpu.glyph(0), self.cpu.character(0x000f, 0x0808))
+        self.assertEquals(self.cpu.glyph(1), self.cpu.character(*characters[2:4]))
+
+    def test_glyph_cached(self):
+        self.assertTrue(self.cpu.glyph(5) is self.cpu.glyph(5))
+
+    def test_glyph_invalidated(self):
+        before = self.cpu.glyph(5)
+        self.cpu.RAM[self.cpu.chars[0] + 10] = 0xffff
+        after = self.cpu.glyph(5)
+        self.assertNotEquals(before, after)
+        self.assertEquals(after, self.cpu.character(0xffff, characters[11]))
+
+    def test_glyphs_kept_between_frames(self):
+        glyphs = self.cpu.glyphs()
+        self.cpu.frame()
+        self.assertTrue(self.cpu.glyphs() is glyphs)
+        self.cpu.RAM[self.cpu.chars[0]] = 0xffff
+        self.cpu.frame()
+        self.assertFalse(self.cpu.glyphs() is glyphs)
+        self.assertEquals(self.cpu.glyph(0),
+                self.cpu.character(0xffff, 0x0808))
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.cpu = FontCPU()
+        # some letters in assorted colors, one of them blinking.
+        for n, value in enumerate([0xf041, 0x1e42, 0x2dc3, 0x7000, 0x0f7f]):
+            self.cpu.RAM[self.cpu.vram[0] + n * 37] = value
+        self.cpu.RAM[self.cpu.background[0]] = 0x0004
+
+    def pixel(self, frame, x, y, border=0):
+        width = frame_size(border)[0]
+        offset = 3 * (y * width + x)
+        return tuple(ord(c) for c in frame[offset:offset + 3])
+
+    def expected(self, x, y, blink=True):
+        "Work out a pixel the slow way."
+        cell = (y // 8) * 32 + x // 4
+        value = self.cpu.RAM[self.cpu.vram[0] + cell]
+        _, _, foreground, background, blinking, char = self.cpu.letter(
+                self.cpu.vram[0] + cell, value)
+        if self.cpu.glyph(char)[y % 8][x % 4] and (blink or
+                not value & 0x80):
+            return foreground
+        return background
+
+    def check(self, frame, blink=True):
+        self.assertEquals(len(frame), 3 * 128 * 96)
+        for y in xrange(96):
+            for x in xrange(128):
+                self.assertEquals(self.pixel(frame, x, y),
+                        self.expected(x, y, blink))
+
+    def test_pure_python(self):
+        numpy, output.numpy = output.numpy, None
+        try:
+            self.check(self.cpu.frame())
+            self.check(self.cpu.frame(blink=False), blink=False)
+            framed = self.cpu.frame(border=2)
+        finally:
+            output.numpy = numpy
+        self.assertEquals(len(framed), 3 * 132 * 100)
+        self.assertEquals(self.pixel(framed, 0, 0, 2), palette[4])
+        self.assertEquals(self.pixel(framed, 131, 99, 2), palette[4])
+
+    @unittest.skipIf(output.numpy == None, "numpy isn't installed")
+    def test_numpy(self):
+        self.check(self.cpu.frame())
+        self.check(self.cpu.frame(blink=False), blink=False)
+
+    @unittest.skipIf(output.numpy == None, "numpy isn't installed")
+    def test_same(self):
+        numpy, output.numpy = output.numpy, None
+        try:
+            slow = self.cpu.frame(blink=False, border=3)
+        finally:
+            output.numpy = numpy
+        self.assertEquals(self.cpu.frame(blink=False, border=3), slow)
+        array = render_array(self.cpu.RAM[0x8000:0x8180],
+                self.cpu.RAM[0x8180:0x8280], 4, border=3)
+        self.assertEquals(array.shape, (102, 134, 3))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sixteen.dcpu16 import DCPU16
+from sixteen.memorymap import MemoryMap
+from sixteen.trace import Tracer
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.cpu = DCPU16()
+        self.cpu.RAM = MemoryMap(self.cpu.cells)
+        # set a, 1 / add a, 1 / jsr 0 / sub pc, 1
+        self.cpu.RAM[:4] = [0x8401, 0x8402, 0x8010, 0x85c3]
+        self.tracer = Tracer(self.cpu, 3)
+
+    def run_cpu(self, count):
+        for _ in xrange(count):
+            self.tracer.record()
+            self.cpu.cycle()
+
+    def test_records(self):
+        self.run_cpu(2)
+        self.assertEquals(list(self.tracer), [
+            (0, 0x8401) + (0,) * 8 + (0, 0),
+            (1, 0x8402, 1) + (0,) * 7 + (0, 0),
+        ])
+
+    def test_ring(self):
+        self.run_cpu(5)
+        self.assertEquals(len(self.tracer), 3)
+        self.assertEquals([r[0] for r in self.tracer], [2, 0, 1])
+
+    def test_reads_without_callbacks(self):
+        read = []
+        self.cpu.RAM.read_callbacks.append(((0, 4),
+            lambda n: read.append(n) or self.cpu.RAM.peek(n)))
+        self.tracer.record()
+        self.assertEquals(read, [])
+
+    def test_dump_and_load(self):
+        self.run_cpu(3)
+        data = self.tracer.dump()
+        self.assertEquals(len(data), 3 * 24)
+        self.assertEquals(list(Tracer.load(data)), list(self.tracer))
+
+    def test_format(self):
+        self.run_cpu(4)
+        lines = self.tracer.format().splitlines()
+        self.assertEquals(len(lines), 3 + 3)
+        self.assertEquals(lines[3], "0001 8402 0001 " + "0000 " * 7
+                + "0000 0000: ADD")
+        self.assertTrue(lines[4].endswith(": JSR"))
+        # and back to the start.
+        self.assertTrue(lines[5].startswith("0000 8401"))
+        self.assertEquals(Tracer.mnemonic(0x0000), "DAT")
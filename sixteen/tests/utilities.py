@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from sixteen.utilities import HexRead, decode_words, ProgramCache
+
+
+class TestDecodeWords(unittest.TestCase):
+    def test_endianness(self):
+        self.assertEquals(decode_words("\x12\x34\xab\xcd"), (0x1234, 0xabcd))
+        self.assertEquals(decode_words("\x12\x34\xab\xcd", False),
+                (0x3412, 0xcdab))
+
+    def test_odd_byte(self):
+        self.assertEquals(decode_words("\x12\x34\x56"), (0x1234,))
+
+
+class TestProgramCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "program")
+        self.cache = ProgramCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data, mtime):
+        with open(self.path, "w") as f:
+            f.write(data)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_hex_matches_hexread(self):
+        self.write("7c01 0030\n7de1\t1000 0020\n", 1000)
+        words = self.cache.load(self.path, hex=True)
+        self.assertEquals(words, (0x7c01, 0x0030, 0x7de1, 0x1000, 0x0020))
+        with HexRead(self.path) as f:
+            self.assertEquals(decode_words(f.read(10)), words)
+
+    def test_cached(self):
+        self.write("\x7c\x01", 1000)
+        words = self.cache.load(self.path)
+        self.assertTrue(self.cache.load(self.path) is words)
+        # the format is part of what's cached.
+        self.assertEquals(self.cache.load(self.path, bigendian=False),
+                (0x017c,))
+
+    def test_changed(self):
+        self.write("\x7c\x01", 1000)
+        self.cache.load(self.path)
+        self.write("\x7c\x02", 1001)
+        self.assertEquals(self.cache.load(self.path), (0x7c02,))
+        # the same time, but a different size.
+        self.write("\x7c\x02\x00\x01", 1001)
+        self.assertEquals(self.cache.load(self.path), (0x7c02, 0x0001))
@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import struct
+import unittest
+from StringIO import StringIO
+from sixteen.characters import characters
+
+try:
+    from twisted.internet.task import Clock
+    from sixteen.web.server import (DCPU16Protocol, encode, protocol_version,
+            halt_flag, errors_flag)
+    from sixteen.trace import Tracer
+    from sixteen.web.sessions import (Session, SessionLimit, LocalSessions,
+            WorkerPool)
+except ImportError:
+    DCPU16Protocol = None
+
+
+def decode(message):
+    "Unpack a message the way dcpu16.js does."
+    version, flags, background, _, cells, chars = struct.unpack("<BBBBHH",
+            message[:8])
+    end = 8 + 4 * cells + 6 * chars
+    words = struct.unpack("<%dH" % ((end - 8) // 2), message[8:end])
+    return {
+        "version": version, "flags": flags, "background": background,
+        "cells": dict(zip(words[:2 * cells:2], words[1:2 * cells:2])),
+        "characters": dict((words[n], words[n + 1:n + 3]) for n in
+            xrange(2 * cells, len(words), 3)),
+        "errors": message[end:],
+    }
+
+
+class Transport(object):
+    def __init__(self):
+        self.written = []
+        self.binary = False
+        self.lost = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def setBinaryMode(self, mode):
+        self.binary = mode
+
+    def loseConnection(self):
+        self.lost = True
+
+
+@unittest.skipIf(DCPU16Protocol == None, "twisted or txws isn't installed")
+class TestEncode(unittest.TestCase):
+    def test_empty(self):
+        self.assertEquals(encode({}, {}), struct.pack("<BBBBHH",
+            protocol_version, 0, 0, 0, 0, 0))
+
+    def test_round_trip(self):
+        message = encode({5: 0xf041, 383: 0x1e42}, {0x41: (0x0102, 0x0304)},
+                0x3, True, ["oops"])
+        self.assertEquals(decode(message), {
+            "version": protocol_version, "flags": 0b111, "background": 3,
+            "cells": {5: 0xf041, 383: 0x1e42},
+            "characters": {0x41: (0x0102, 0x0304)},
+            "errors": "oops",
+        })
+
+    def test_full_screen_is_small(self):
+        message = encode(dict((n, 0xf041) for n in xrange(384)), {})
+        self.assertEquals(len(message), 8 + 384 * 4)
+
+
+@unittest.skipIf(DCPU16Protocol == None, "twisted or txws isn't installed")
+class TestProtocol(unittest.TestCase):
+    # set [0x8021], 0xf041 / set [0x8183], 0x00ff / sub pc, 1
+    program = [0x7de1, 0x8021, 0xf041, 0x7de1, 0x8183, 0x00ff, 0x85c3]
+
+    def setUp(self):
+        self.clock = Clock()
+        self.sessions = LocalSessions(self.clock.seconds)
+        self.machines = {}
+        self.protocol = self.connect(self.program)
+
+    def connect(self, program, first=["run"]):
+        class Protocol(DCPU16Protocol):
+            reactor = self.clock
+        protocol = Protocol(program, self.sessions, self.machines)
+        protocol.transport = Transport()
+        protocol.connectionMade()
+        protocol.dataReceived(json.dumps(first))
+        return protocol
+
+    def session(self, protocol=None):
+        protocol = protocol or self.protocol
+        return self.sessions.sessions[protocol.machine.session]
+
+    def messages(self, protocol=None):
+        "The frames a client got, decoded; text messages are left out."
+        protocol = protocol or self.protocol
+        return [decode(m) for m in protocol.transport.written
+                if not isinstance(m, unicode)]
+
+    def test_default_font(self):
+        session = self.session()
+        self.assertEquals(session.cpu.RAM[0x8180:0x8280], list(characters))
+        self.assertEquals(session.chars_changed[0x41],
+                tuple(characters[0x82:0x84]))
+        self.assertEquals(len(session.letters_changed), 384)
+
+    def test_binary_mode(self):
+        self.assertTrue(self.protocol.transport.binary)
+
+    def test_runs_on_its_own(self):
+        # the first frame has the whole font and screen in it.
+        self.clock.advance(0)
+        first, = self.messages()
+        self.assertEquals(len(first["characters"]), 128)
+        self.assertEquals(len(first["cells"]), 384)
+        # and the next has what the program did before it stopped.
+        self.clock.advance(0.01)
+        _, second = self.messages()
+        self.assertEquals(second["cells"], {0x21: 0xf041})
+        top = self.session().cpu.RAM[0x8182]
+        self.assertEquals(second["characters"], {1: (top, 0x00ff)})
+        self.assertEquals(second["flags"], halt_flag)
+        # it's stopped, so there's nothing scheduled.
+        self.assertEquals(self.protocol.machine.call, None)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    def test_frames_wait_for_acks(self):
+        self.protocol.in_flight_limit = 1
+        self.clock.advance(0)
+        self.clock.advance(0.01)
+        self.assertEquals(len(self.messages()), 1)
+        self.protocol.dataReceived(json.dumps(["ack"]))
+        self.assertEquals(len(self.messages()), 2)
+        self.assertEquals(self.messages()[1]["cells"], {0x21: 0xf041})
+
+    def test_frame_rate(self):
+        # add [0x8000], 1 / sub pc, 3 -- changes the screen every time around
+        protocol = self.connect([0x89e2, 0x8000, 0x8dc3])
+        for _ in xrange(100):
+            self.clock.advance(0.01)
+            protocol.dataReceived(json.dumps(["ack"]))
+        # a second's worth of slices, but only 30 frames.
+        self.assertTrue(29 <= len(self.messages(protocol)) <= 31)
+
+    def test_keys_wake(self):
+        self.clock.advance(0)
+        self.clock.advance(0.01)
+        self.assertEquals(self.protocol.machine.call, None)
+        self.protocol.dataReceived(json.dumps(["keys", ["a"]]))
+        self.assertEquals(self.session().cpu.RAM[0x9001], ord("a"))
+        self.assertNotEquals(self.protocol.machine.call, None)
+
+    def test_pause(self):
+        self.protocol.dataReceived(json.dumps(["pause"]))
+        self.clock.advance(1)
+        self.assertEquals(self.session().cpu.cycles, 0)
+        self.protocol.dataReceived(json.dumps(["resume"]))
+        self.clock.advance(0)
+        self.clock.advance(0.01)
+        self.assertEquals(self.session().cpu.RAM[0x8021], 0xf041)
+
+    def test_errors_halt(self):
+        protocol = self.connect([0x0000])
+        self.clock.advance(0)
+        self.clock.advance(0.01)
+        message = self.messages(protocol)[-1]
+        self.assertTrue(message["flags"] & errors_flag)
+        self.assertEquals(protocol.machine.call, None)
+
+    def test_told_token(self):
+        token = self.protocol.machine.token
+        self.assertEquals(json.loads(self.protocol.transport.written[0]),
+                ["machine", token])
+        self.assertTrue(self.machines[token] is self.protocol.machine)
+
+    def test_spectators_share_frames(self):
+        self.clock.advance(0)
+        token = self.protocol.machine.token
+        spectators = [self.connect([0x0000], ["watch", token])
+                for _ in xrange(2)]
+        # no new programs, and the latecomers get the whole display.
+        self.assertEquals(len(self.sessions.sessions), 1)
+        for spectator in spectators:
+            snapshot, = self.messages(spectator)
+            self.assertEquals(len(snapshot["cells"]), 384)
+            self.assertEquals(len(snapshot["characters"]), 128)
+        # and after that, the same frame as the controller, encoded once.
+        self.clock.advance(0.01)
+        frames = [p.transport.written[-1]
+                for p in [self.protocol] + spectators]
+        self.assertEquals(decode(frames[0])["cells"], {0x21: 0xf041})
+        self.assertTrue(frames[0] is frames[1] is frames[2])
+
+    def test_spectators_only_watch(self):
+        token = self.protocol.machine.token
+        spectator = self.connect([0x0000], ["watch", token])
+        spectator.dataReceived(json.dumps(["pause"]))
+        spectator.dataReceived(json.dumps(["keys", ["a"]]))
+        self.assertFalse(self.protocol.machine.paused)
+        self.assertEquals(self.session().cpu.input_queue, None)
+
+    def test_slow_spectators_catch_up(self):
+        protocol = self.connect([0x89e2, 0x8000, 0x8dc3])
+        self.clock.advance(0)
+        spectator = self.connect([0x0000], ["watch", protocol.machine.token])
+        # the spectator never acks, so it misses frames...
+        for _ in xrange(20):
+            self.clock.advance(0.04)
+            protocol.dataReceived(json.dumps(["ack"]))
+        self.assertTrue(len(self.messages(protocol)) > 10)
+        self.assertEquals(len(self.messages(spectator)), 2)
+        self.assertTrue(spectator.stale)
+        # until it's drawn them, and then it gets the whole display again.
+        spectator.dataReceived(json.dumps(["ack"]))
+        snapshot = self.messages(spectator)[-1]
+        self.assertEquals(len(snapshot["cells"]), 384)
+        self.assertEquals(snapshot["cells"][0],
+                self.session(protocol).cpu.RAM[0x8000])
+        self.assertFalse(spectator.stale)
+
+    def test_controller_leaving(self):
+        machine = self.protocol.machine
+        spectator = self.connect([0x0000], ["watch", machine.token])
+        self.protocol.dataReceived(json.dumps(["pause"]))
+        self.protocol.connectionLost(None)
+        # the spectators still get to see it.
+        self.assertFalse(machine.paused)
+        self.assertEquals(len(self.sessions.sessions), 1)
+        spectator.connectionLost(None)
+        self.assertEquals(self.sessions.sessions, {})
+        self.assertEquals(self.machines, {})
+
+    def test_nothing_to_watch(self):
+        spectator = self.connect([0x0000], ["watch", "nope"])
+        self.assertTrue(spectator.transport.lost)
+        self.assertTrue(self.messages(spectator)[0]["flags"] & errors_flag)
+
+    def test_session_limit(self):
+        self.sessions.max_sessions = 1
+        protocol = self.connect(self.program)
+        self.assertTrue(protocol.transport.lost)
+        # but spectators don't count.
+        spectator = self.connect([0x0000],
+                ["watch", self.protocol.machine.token])
+        self.assertFalse(spectator.transport.lost)
+
+    def test_bad_messages(self):
+        protocol = DCPU16Protocol(self.program, self.sessions, self.machines)
+        protocol.transport = Transport()
+        bad = ["{", "{}", "[]", "[1]", '[["keys"]]', '["bogus"]',
+                '["keys", "a"]', '["keys", [1]]', '["keys", [], 1]',
+                '["watch", 3]', '["ack", 1]', '["trace", "10"]',
+                '["trace", true]', '["trace", NaN]', '["trace", Infinity]']
+        for data in bad:
+            protocol.dataReceived(data)
+            self.protocol.dataReceived(data)
+        # none of them start a program or get anywhere near one.
+        self.assertEquals(protocol.machine, None)
+        self.assertEquals(self.session().cpu.input_queue, None)
+        self.assertEquals(len(self.sessions.sessions), 1)
+
+    def test_trace(self):
+        self.protocol.dataReceived(json.dumps(["trace", 10]))
+        self.assertEquals(self.session().tracer.size, 10)
+        # spectators can't turn it off.
+        spectator = self.connect([0x0000],
+                ["watch", self.protocol.machine.token])
+        spectator.dataReceived(json.dumps(["trace", 0]))
+        self.assertNotEquals(self.session().tracer, None)
+        self.protocol.dataReceived(json.dumps(["trace", 0]))
+        self.assertEquals(self.session().tracer, None)
+
+    def test_trace_limits(self):
+        self.protocol.dataReceived(json.dumps(["trace", 10 ** 9]))
+        self.assertEquals(self.session().tracer.size, Tracer.size)
+        self.protocol.dataReceived(json.dumps(["trace", 12.5]))
+        self.assertEquals(self.session().tracer.size, 12)
+        self.protocol.dataReceived(json.dumps(["trace", -5]))
+        self.assertEquals(self.session().tracer, None)
+        self.assertRaises(ValueError, self.session().trace, -5)
+
+    def test_font_change_redraws_users(self):
+        session = self.session()
+        cpu = session.cpu
+        cpu.RAM[0x8000] = 0x0141
+        cpu.RAM[0x8005] = 0x2041
+        cpu.RAM[0x8006] = 0x2042
+        # and one that used to be an "A".
+        cpu.RAM[0x8007] = 0x0041
+        cpu.RAM[0x8007] = 0x0043
+        self.assertEquals(cpu.char_cells[0x41], set([0, 5]))
+        self.assertEquals(cpu.char_cells[0x43], set([7]))
+        self.assertEquals(len(cpu.char_cells[0]), 384 - 4)
+        session.letters_changed = {}
+        cpu.RAM[0x8180 + 2 * 0x41] = 0xffff
+        self.assertEquals(session.letters_changed,
+                {0: 0x0141, 5: 0x2041})
+
+
+class Reactor(object):
+    "Just enough of a reactor for a WorkerPool."
+    def __init__(self):
+        self.readers = []
+
+    def addReader(self, reader):
+        self.readers.append(reader)
+
+    def removeReader(self, reader):
+        self.readers.remove(reader)
+
+
+@unittest.skipIf(DCPU16Protocol == None, "twisted or txws isn't installed")
+class TestSessions(unittest.TestCase):
+    # add a, 1 / sub pc, 2 -- count forever
+    program = [0x8402, 0x89c3]
+
+    def test_quota(self):
+        clock = Clock()
+        sessions = LocalSessions(clock.seconds)
+        sid = sessions.open(self.program)
+        clock.advance(1)
+        results = []
+        sessions.run(sid).addCallback(results.append)
+        (changes, stopped, wait), = results
+        # a slice can't run more than its quota, however much is due...
+        self.assertEquals(sessions.sessions[sid].cpu.cycles, Session.quota)
+        self.assertFalse(stopped)
+        # so the next one should start right away.
+        self.assertEquals(wait, 0)
+        # and the first changes are the whole screen and font.
+        self.assertEquals(len(changes[0]), 384)
+        self.assertEquals(len(changes[1]), 128)
+
+    def test_adaptive_quota(self):
+        session = Session(self.program)
+        # a thousand cycles in 10ms is 100 kHz, so 5ms is 500 cycles.
+        session.adapt(1000, 0.01)
+        self.assertEquals(session.quota, 500)
+        # it doesn't change its mind all at once,
+        session.adapt(1000, 0.005)
+        self.assertEquals(session.quota, 625)
+        # short slices don't count,
+        session.adapt(10, 0.0001)
+        self.assertEquals(session.quota, 625)
+        # and however slow things get, slices still do something.
+        for _ in xrange(50):
+            session.adapt(100, 1.0)
+        self.assertEquals(session.quota, Session.minimum_quota)
+
+    def test_quota_follows_the_host(self):
+        # a clock that moves along while the program runs.
+        times = iter(xrange(10 ** 6))
+        session = Session(self.program, lambda: next(times) * 0.001)
+        session.governor.due = lambda: 10000
+        session.run_slice()
+        # 2000 cycles in a millisecond: 10000 in 5ms.
+        self.assertEquals(session.cpu.cycles, 2000)
+        self.assertEquals(session.quota, 10000)
+        session.run_slice()
+        self.assertEquals(session.cpu.cycles, 12000)
+
+    def test_waiting_keeps_time(self):
+        clock = Clock()
+        sessions = LocalSessions(clock.seconds)
+        # sub pc, 1 -- wait forever
+        sid = sessions.open([0x85c3])
+        session = sessions.sessions[sid]
+        recording = session.cpu.record()
+        results = []
+        clock.advance(0.01)
+        sessions.run(sid).addCallback(results.append)
+        (_, stopped, _), = results
+        self.assertTrue(stopped)
+        # nothing runs while it's waiting, but its clock keeps going.
+        clock.advance(5)
+        sessions.feed(sid, ["a"])
+        sessions.wake(sid)
+        self.assertEquals(recording, [(501000, ord("a"))])
+        self.assertEquals(session.governor.due(), 0)
+        # however long it waits, it only catches up so far.
+        clock.advance(0.01)
+        sessions.run(sid)
+        clock.advance(10 ** 6)
+        sessions.wake(sid)
+        self.assertEquals(session.cpu.cycles,
+                502000 + Session.idle_limit * session.governor.rate)
+
+    def test_trace_on_error(self):
+        # set a, 1 / set b, 2 / dat 0
+        sessions = LocalSessions(trace=2)
+        sid = sessions.open([0x8401, 0x8811, 0x0000])
+        session = sessions.sessions[sid]
+        session.governor.due = lambda: 10
+        output = StringIO()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            sessions.run(sid)
+        finally:
+            sys.stdout = stdout
+        # the last two instructions, up to the one that broke.
+        self.assertEquals([r[:4] for r in session.tracer],
+                [(1, 0x8811, 1, 0), (2, 0x0000, 1, 2)])
+        lines = output.getvalue().splitlines()
+        self.assertTrue("unknown opcode" in lines[0])
+        self.assertEquals(len(lines), 6)
+        self.assertTrue(lines[-1].endswith(": DAT"))
+
+    def test_untraced(self):
+        sessions = LocalSessions()
+        sid = sessions.open(self.program)
+        self.assertEquals(sessions.sessions[sid].tracer, None)
+
+    def test_session_limit(self):
+        sessions = LocalSessions(max_sessions=1)
+        sid = sessions.open(self.program)
+        self.assertRaises(SessionLimit, sessions.open, self.program)
+        sessions.close(sid)
+        sessions.open(self.program)
+
+    def pump(self, reactor, done):
+        "Let workers' replies through until done() is True."
+        for _ in xrange(100):
+            for reader in list(reactor.readers):
+                if reader.connection.poll(0.05):
+                    reader.doRead()
+            if done():
+                return
+
+    def shut(self, pool):
+        for connection in pool.connections:
+            connection.close()
+        for process in pool.processes:
+            process.join(5)
+
+    def collect(self, pool, sids):
+        "Run a slice of each session; return the results and failures."
+        results, failures = {}, {}
+        for sid in sids:
+            pool.run(sid).addCallbacks(
+                    lambda r, sid=sid: results.__setitem__(sid, r),
+                    lambda f, sid=sid: failures.__setitem__(sid, f))
+        return results, failures
+
+    def test_worker_pool(self):
+        reactor = Reactor()
+        pool = WorkerPool(2, max_sessions=3, reactor=reactor)
+        try:
+            # sub pc, 1
+            sids = [pool.open([0x85c3]) for _ in xrange(3)]
+            self.assertRaises(SessionLimit, pool.open, [0x85c3])
+            # sessions get spread over the workers.
+            self.assertEquals(sorted(len(s) for s in pool.load.values()),
+                    [1, 2])
+            results, _ = self.collect(pool, sids)
+            self.pump(reactor, lambda: len(results) == 3)
+            self.assertEquals(sorted(results), sids)
+            changes, stopped, wait = results[sids[0]]
+            self.assertEquals(len(changes[0]), 384)
+        finally:
+            self.shut(pool)
+
+    def test_worker_errors(self):
+        reactor = Reactor()
+        pool = WorkerPool(1, reactor=reactor)
+        try:
+            bad, good = pool.open([0x85c3]), pool.open([0x85c3])
+            # keys that aren't strings.
+            pool.feed(bad, [1])
+            results, failures = self.collect(pool, [bad, good])
+            self.pump(reactor, lambda: len(results) + len(failures) == 2)
+            # only the session it was about fails,
+            self.assertEquals(results.keys(), [good])
+            self.assertTrue("TypeError" in
+                    failures[bad].getErrorMessage())
+            # and the worker keeps going.
+            self.assertTrue(pool.processes[0].is_alive())
+            results, _ = self.collect(pool, [good])
+            self.pump(reactor, lambda: results)
+            self.assertEquals(results.keys(), [good])
+        finally:
+            self.shut(pool)
+
+    def test_worker_dies(self):
+        reactor = Reactor()
+        pool = WorkerPool(1, reactor=reactor)
+        try:
+            sid = pool.open([0x85c3])
+            dead = pool.processes[0]
+            dead.terminate()
+            dead.join(5)
+            results, failures = self.collect(pool, [sid])
+            self.pump(reactor, lambda: failures)
+            self.assertEquals(failures[sid].getErrorMessage(),
+                    "worker process died")
+            # it's gone from the pool, and another one took its place.
+            self.assertEquals(pool.placement, {})
+            self.assertEquals(len(pool.connections), 1)
+            self.assertEquals(len(pool.load), 1)
+            self.assertFalse(pool.processes[0] is dead)
+            # which works, while anything more about the old session goes
+            # nowhere.
+            pool.feed(sid, ["a"])
+            pool.close(sid)
+            sid = pool.open([0x85c3])
+            results, _ = self.collect(pool, [sid])
+            self.pump(reactor, lambda: results)
+            self.assertEquals(results.keys(), [sid])
+        finally:
+            self.shut(pool)
+
+    def test_no_workers(self):
+        pool = WorkerPool(0, reactor=Reactor())
+        self.assertRaises(SessionLimit, pool.open, [0x85c3])
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import unittest
-from sixteen.words import as_opcode, from_opcode, bit_iter
+from sixteen.words import as_opcode, from_opcode, bit_iter, tables
 
 
 # a bunch of instructions, seperated into their components
@@ -41,3 +41,34 @@ class TestBitIter(unittest.TestCase):
         self.assertBits(0b1011, 4, [1, 0, 1, 1])
         self.assertBits(0b1000, 4, [1, 0, 0, 0])
         self.assertBits(0b10001000, 8, [1, 0, 0, 0, 1, 0, 0, 0])
+
+
+class TestDecodeTables(unittest.TestCase):
+    def test_fields(self):
+        for word in xrange(0, 0x10000, 7):
+            self.assertEquals((tables.opcode[word], tables.a[word],
+                tables.b[word]), as_opcode(word))
+
+    def test_length(self):
+        # set A, next word
+        self.assertEquals(tables.length[0x7c01], 2)
+        # set [next word], next word
+        self.assertEquals(tables.length[0x7de1], 3)
+        # set I, 10
+        self.assertEquals(tables.length[0xa861], 1)
+        # jsr next word
+        self.assertEquals(tables.length[0x7c10], 2)
+
+    def test_cycles(self):
+        # set A, next word: one for SET, one for the next word
+        self.assertEquals(tables.cycles[0x7c01], 2)
+        # ifn A, 0x10
+        self.assertEquals(tables.cycles[0xc00d], 2)
+        # jsr next word
+        self.assertEquals(tables.cycles[0x7c10], 3)
+
+    def test_valid(self):
+        self.assertEquals(tables.valid[0x7c01], 1)
+        self.assertEquals(tables.valid[0x7c10], 1)
+        self.assertEquals(tables.valid[0x0000], 0)
+        self.assertEquals(tables.cycles[0x0000], 0)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tracing: remember what a cpu did recently, cheaply enough to leave on.
+
+Rather than printing every instruction as it goes, a Tracer keeps the last few
+thousand in a ring buffer of small binary records and only turns them into
+text when somebody asks -- usually because something went wrong.
+"""
+
+import struct
+from collections import deque
+from sixteen.words import tables
+from sixteen.dis import mnemonics, special_mnemonics
+
+
+# the registers in a record, after the PC and the instruction word.
+registers = ["A", "B", "C", "X", "Y", "Z", "I", "J", "SP", "O"]
+
+
+class Tracer(object):
+    """Keep the last "size" instructions a cpu ran, as long as record gets
+    called before each one. Each one is a record of twelve little-endian
+    words: the PC it was at, the instruction word and then the registers in
+    "registers", as they were before it ran -- so the last record is the
+    instruction that was running when something went wrong.
+    """
+    size = 4096
+    record_format = struct.Struct("<12H")
+
+    def __init__(self, cpu, size=size):
+        self.cpu = cpu
+        self.size = size
+        self.records = deque(maxlen=size)
+        # look at memory without setting off any read callbacks.
+        if cpu != None:
+            self._peek = getattr(cpu.RAM, "peek", cpu.RAM.__getitem__)
+
+    def record(self):
+        "Note the instruction the cpu's about to run."
+        r = self.cpu.registers
+        pc = r["PC"]
+        self.records.append(self.record_format.pack(pc, self._peek(pc),
+            r["A"], r["B"], r["C"], r["X"], r["Y"], r["Z"], r["I"], r["J"],
+            r["SP"], r["O"]))
+
+    def clear(self):
+        self.records.clear()
+
+    def dump(self):
+        "Return the records, oldest first, as one string of bytes."
+        return "".join(self.records)
+
+    @classmethod
+    def load(cls, data):
+        """Make a tracer (without a cpu) out of what dump returned, to look at
+        the records somewhere else.
+        """
+        size = cls.record_format.size
+        tracer = cls(None, max(1, len(data) // size))
+        for n in xrange(0, len(data) - size + 1, size):
+            tracer.records.append(data[n:n + size])
+        return tracer
+
+    def __iter__(self):
+        "Iterate over the records as tuples of words."
+        unpack = self.record_format.unpack
+        for record in self.records:
+            yield unpack(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def mnemonic(word):
+        "The name of the operation an instruction word is, or DAT if none."
+        o = tables.opcode[word]
+        if o == 0x00:
+            name = special_mnemonics[tables.a[word]]
+        else:
+            name = mnemonics[o]
+        return name or "DAT"
+
+    def format(self):
+        "Return the records as a table, like sixteen-web used to print."
+        rule = " ".join(["----"] * 12)
+        lines = [
+            rule,
+            "PC   word " + " ".join("%-4s" % r for r in registers).rstrip(),
+            rule,
+        ]
+        for record in self:
+            lines.append("%04x %04x " % record[:2]
+                    + " ".join("%04x" % w for w in record[2:])
+                    + ": " + self.mnemonic(record[1]))
+        return "\n".join(lines)
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 
+import os
+import sys
+from array import array
+
 
 class HexRead(object):
     "A file-like object for reading hex dumps with possible whitespace."
@@ -58,6 +62,47 @@ def file_to_ram(f, cpu, bigendian=True, offset=0):
         else:
             break
 
+def decode_words(data, bigendian=True):
+    """Given a string of bytes, return the 16-bit words in it as a tuple. An
+    odd byte at the end gets dropped, like file_to_ram does.
+    """
+    words = array("H", data[:len(data) - len(data) % 2])
+    # array uses the machine's byte order.
+    if bigendian != (sys.byteorder == "big"):
+        words.byteswap()
+    return tuple(words)
+
+
+class ProgramCache(object):
+    """Read programs from files, keeping the words of each one around for as
+    long as the file doesn't change -- so a server that loads the same
+    program over and over only has to stat it. Programs are cached by path
+    and format; a different modification time or size means it's read
+    again.
+    """
+    def __init__(self):
+        # (path, hex, bigendian) -> ((mtime, size), words)
+        self.programs = {}
+
+    def load(self, path, hex=False, bigendian=True):
+        """Return the words of the program in a file (an ASCII hex dump if
+        "hex" is True) as a tuple.
+        """
+        key = path, hex, bigendian
+        stat = os.stat(path)
+        version = stat.st_mtime, stat.st_size
+        cached = self.programs.get(key)
+        if cached != None and cached[0] == version:
+            return cached[1]
+        with open(path) as f:
+            data = f.read()
+        if hex:
+            data = "".join(data.split()).decode("hex")
+        words = decode_words(data, bigendian)
+        self.programs[key] = version, words
+        return words
+
+
 class OpcodeError(Exception):
     def __init__(self, value, address=None):
         self.value = value
@@ -2,14 +2,41 @@
 var canvas = null;
 var context = null;
 var socket = null;
-var focus = true;
 var halt = false;
+// whether this is our program, or we're just watching somebody else's.
+var controlling = false;
 
-// a list that we'll put keypresses in and send to the server.
-var keypresses = []
+// the version of the binary protocol we understand, and the flags in its
+// header. see encode in sixteen/web/server.py.
+var protocol_version = 2;
+var halt_flag = 1;
+var background_flag = 2;
+var errors_flag = 4;
 
-// characters is an empty object that we'll use to keep track of 
-var characters = {};
+// the raw words of video ram and of the font, as the backend sends them.
+var vram = new Uint16Array(32 * 12);
+var font = new Uint16Array(256);
+
+// the sixteen hrgb colors as css colors, for the border, and as pixels in an
+// ImageData, for everything else. ImageData is rgba bytes, so a pixel read
+// as a 32-bit word is abgr on little-endian machines.
+var colors = [];
+var pixel_colors = new Uint32Array(16);
+var little_endian = new Uint8Array(new Uint32Array([1]).buffer)[0] == 1;
+for (var bits = 0; bits < 16; bits++) {
+    var h = (bits & 8) ? 0x55 : 0;
+    var rgb = [4, 2, 1].map(function (bit) {
+        return ((bits & bit) ? 0xaa : 0) + h;
+    });
+    colors.push("rgb(" + rgb.join(",") + ")");
+    if (little_endian) {
+        pixel_colors[bits] = (0xff << 24 | rgb[2] << 16 | rgb[1] << 8
+            | rgb[0]) >>> 0;
+    } else {
+        pixel_colors[bits] = (rgb[0] << 24 | rgb[1] << 16 | rgb[2] << 8
+            | 0xff) >>> 0;
+    };
+};
 
 // constants for the height and width of pixels and characters
 var pixel_width = 4;
@@ -18,6 +45,18 @@ var pixel_height = 4;
 var char_width = 4;
 var char_height = 8;
 
+// the display at one canvas pixel per dcpu pixel: cells get drawn into
+// "pixels" (a view of "image"), and then the part that changed gets put on
+// "screen" and scaled up onto the real canvas, once per frame.
+var screen_width = char_width * 32;
+var screen_height = char_height * 12;
+var screen = null;
+var screen_context = null;
+var image = null;
+var pixels = null;
+// the corners of what's changed since the last blit, in cells.
+var dirty = null;
+
 
 function init() {
     // on the window's load, get canvas and its 2D context
@@ -25,9 +64,18 @@ function init() {
     canvas.width = char_width * pixel_width * 32;
     canvas.height = char_height * pixel_height * 12;
     context = canvas.getContext("2d");
+    context.imageSmoothingEnabled = false;
+    context.mozImageSmoothingEnabled = false;
+    context.webkitImageSmoothingEnabled = false;
+
+    screen = document.createElement("canvas");
+    screen.width = screen_width;
+    screen.height = screen_height;
+    screen_context = screen.getContext("2d");
+    image = screen_context.createImageData(screen_width, screen_height);
+    pixels = new Uint32Array(image.data.buffer);
 
-    // add a keypress handler that pushes keypresses to the 
-    // place where we keep them.
+    // add a keypress handler that sends keypresses straight to the backend.
     window.addEventListener("keypress", function (key) {
         if (key.keyCode == 13) {
             // convert carriage return to newline
@@ -37,17 +85,23 @@ function init() {
         } else {
             var k = key.charCode;
         }
-        keypresses.push(String.fromCharCode(k));
+        if (controlling) {
+            send(["keys", [String.fromCharCode(k)]]);
+        };
     });
 
-    // add keypress handlers that let us know when we lose or get focus.
+    // the backend runs on its own, but there's no point in it running while
+    // nobody's looking.
     window.addEventListener("blur", function () {
-        focus = false;
+        if (controlling) {
+            send(["pause"]);
+        };
     }); 
 
     window.addEventListener("focus", function () {
-        focus = true;
-        cycle();
+        if (controlling && !halt) {
+            send(["resume"]);
+        };
     });
 }
 
@@ -56,54 +110,108 @@ function init() {
 window.addEventListener('load', init, false);
 
 
-// initialize a websocket
+// initialize a websocket, and get its messages as ArrayBuffers.
 socket = new WebSocket("ws://localhost:4314");
+socket.binaryType = "arraybuffer";
 
 
 socket.onopen = function(msg) {
     // when the socket opens, let us debuggers know
     console.log("[Socket opened]");
-    socket.send(JSON.stringify([[], 200]));
+    // a page like http://localhost:1268/#token watches somebody else's
+    // program; otherwise, run our own.
+    var token = window.location.hash.slice(1);
+    if (token) {
+        send(["watch", token]);
+    } else {
+        send(["run"]);
+    };
+}
 
+
+function send(message) {
+    // send a message to the backend, if it's there.
+    if (socket.readyState == WebSocket.OPEN) {
+        socket.send(JSON.stringify(message));
+    };
 }
 
 socket.onmessage = function(msg) {
-    // get the json data from the message
-    data = JSON.parse(msg.data);
+    // text messages are about the program; binary ones are frames.
+    if (typeof msg.data == "string") {
+        machine(JSON.parse(msg.data));
+        return;
+    };
+    var header = new Uint8Array(msg.data, 0, 8);
+    if (header[0] != protocol_version) {
+        halt = true;
+        error_handler("unknown protocol version " + header[0]);
+        return;
+    };
+    var flags = header[1];
+    // the rest is sixteen-bit words. the backend sends them little-endian,
+    // which is what typed arrays use everywhere that matters.
+    var counts = new Uint16Array(msg.data, 4, 2);
+    var cells = new Uint16Array(msg.data, 8, counts[0] * 2);
+    var chars = new Uint16Array(msg.data, 8 + cells.byteLength, counts[1] * 3);
+
     // if we get a background color, change the canvas' border.
-    if (data["background"] != null) {
-        canvas.style.borderColor = data["background"];
+    if (flags & background_flag) {
+        canvas.style.borderColor = colors[header[2]];
     };
 
-    // iterate through the given new characters and change our map of
-    // characters.
-    Object.keys(data["characters"]).forEach(function (key) {
-        characters[key] = data["characters"][key];
-    });
-    
-    if (data["halt"] == true) {
-        halt = true;
+    // (character, top, bottom) triples for the font.
+    for (var n = 0; n < chars.length; n += 3) {
+        font[chars[n] * 2] = chars[n + 1];
+        font[chars[n] * 2 + 1] = chars[n + 2];
     };
 
-    // and then change all the cells
-    data.cells.forEach(draw_cell);
-    if (data["errors"].length == 0) {
-        if (focus & !halt) {
-            cycle();
-        };
-    } else {
+    // and then (index, word) pairs for the cells that changed. a changed
+    // character comes with every cell that uses it, so that's all there is
+    // to redraw.
+    for (var n = 0; n < cells.length; n += 2) {
+        vram[cells[n]] = cells[n + 1];
+        draw_cell(cells[n]);
+    };
+    blit();
+
+    // let the backend know we've drawn this, so it can send another.
+    send(["ack"]);
+    if (flags & errors_flag) {
         halt = true;
-        data["errors"].forEach(error_handler);
+        var offset = 8 + cells.byteLength + chars.byteLength;
+        var text = new TextDecoder("utf-8").decode(
+            new Uint8Array(msg.data, offset));
+        text.split("\n").forEach(error_handler);
     };
 };
 
 
-function cycle () {
-    // register a callback to send a reply in.
-    setTimeout(function () {
-        socket.send(JSON.stringify([keypresses, 400]));
-        keypresses = [];
-    }, 70);
+// for debugging, from the console: keep track of the last so many
+// instructions of our program (or stop, with 0), and have them printed on the
+// server. they're printed anyway if the program hits an error.
+function trace(size) {
+    send(["trace", size]);
+}
+
+function dump() {
+    send(["dump"]);
+}
+
+
+function machine(message) {
+    // we're running our own program; show where other people can watch it.
+    controlling = true;
+    var url = window.location.href.split("#")[0] + "#" + message[1];
+    var link = document.createElement("a");
+    link.href = url;
+    link.target = "_blank";
+    link.appendChild(document.createTextNode(url));
+    var div = document.createElement("div");
+    div.appendChild(document.createTextNode("others can watch at "));
+    div.appendChild(link);
+    div.classList.add("watch");
+    document.body.appendChild(div);
 }
 
 
@@ -114,40 +222,58 @@ function error_handler (text) {
     div.onclick = function () {
         halt = false;
         document.body.removeChild(div);
-        cycle();
+        if (controlling) {
+            send(["resume"]);
+        };
     };
     document.body.appendChild(div);
 }
 
 
-function draw_pixel(x, y) {
-    var x_a = pixel_width * x;
-    var y_a = pixel_height * y;
-    context.fillRect(x_a, y_a, pixel_width, pixel_height);
+function draw_cell(index) {
+    // a cell is ffffbbbbBccccccc: colors, blink and the character.
+    var word = vram[index];
+    var column = index % 32;
+    var line = Math.floor(index / 32);
+    var foreground = pixel_colors[word >> 12];
+    var background = pixel_colors[(word >> 8) & 0xf];
+    // each byte of the character's two font words is a column, with the top
+    // row in the lowest bit; go through them a row at a time.
+    var char = word & 0x7f;
+    var top = font[char * 2];
+    var bottom = font[char * 2 + 1];
+    var columns = [top >> 8, top & 0xff, bottom >> 8, bottom & 0xff];
+    var p = line * char_height * screen_width + column * char_width;
+    for (var r = 0; r < char_height; r++) {
+        for (var c = 0; c < char_width; c++) {
+            pixels[p + c] = ((columns[c] >> r) & 1) ? foreground : background;
+        };
+        p += screen_width;
+    };
+    // remember what needs to go on the canvas.
+    if (dirty == null) {
+        dirty = [column, line, column, line];
+    } else {
+        dirty = [Math.min(dirty[0], column), Math.min(dirty[1], line),
+            Math.max(dirty[2], column), Math.max(dirty[3], line)];
+    };
 };
 
 
-function draw_cell(n) {
-    // adjust the coordinates
-    var x = char_width * pixel_width * n.x;
-    var y = char_height * pixel_height * n.y;
-    // draw the background
-    context.fillStyle = n.background;
-    context.fillRect(x, y, char_width * pixel_width, char_height * pixel_height);
-    // draw the character
-    character = characters[n["char"]];
-    context.fillStyle = n.foreground;
-    var r = 0;
-    character.forEach(function (row) {
-        var column = 0;
-        row.forEach(function (cell) {
-            if (cell == 1) {
-                draw_pixel((n.x * char_width) + column, (n.y * char_height) + r)
-            };
-            column++;
-        });
-        r++;
-    });
+function blit() {
+    // put the cells that changed on the canvas, all at once.
+    if (dirty == null) {
+        return;
+    };
+    var x = dirty[0] * char_width;
+    var y = dirty[1] * char_height;
+    var width = (dirty[2] + 1) * char_width - x;
+    var height = (dirty[3] + 1) * char_height - y;
+    screen_context.putImageData(image, 0, 0, x, y, width, height);
+    context.drawImage(screen, x, y, width, height,
+        x * pixel_width, y * pixel_height,
+        width * pixel_width, height * pixel_height);
+    dirty = null;
 };
 
 
@@ -1,4 +1,6 @@
+import os
 import json
+import struct
 from twisted.internet import protocol, reactor
 from txws import WebSocketFactory
 from sixteen.dcpu16 import DCPU16
@@ -7,23 +9,121 @@ from sixteen.input import InputCPU
 from sixteen.halting import LoopDetecting
 from sixteen.memorymap import MemoryMap
 from sixteen.characters import characters
+from sixteen.trace import Tracer
+
+
+# the version of the protocol below; the frontend checks it.
+protocol_version = 2
+
+# flags in the second byte of a message.
+halt_flag, background_flag, errors_flag = 0b001, 0b010, 0b100
+
+# the default font as (top, bottom) pairs by character, the way
+# change_character reports it; worked out once, rather than per connection.
+default_font = dict((n, tuple(characters[2 * n:2 * n + 2]))
+        for n in xrange(len(characters) // 2))
+
+
+def encode(cells, font, background=None, halt=False, errors=()):
+    """Pack changes to the display into a binary message for the frontend.
+
+    The message starts with an eight-byte header: the protocol version, a
+    byte of flags (halt_flag, background_flag and errors_flag), the
+    background color as a nibble, a zero byte, and then the number of cells
+    and characters as sixteen-bit words. Then come (cell index, vram word)
+    pairs for the cells and (character, top word, bottom word) triples for
+    the font, all as little-endian sixteen-bit words. Errors, if there are
+    any, follow as utf-8 text, one per line.
+    """
+    flags = ((halt_flag if halt else 0)
+            | (background_flag if background != None else 0)
+            | (errors_flag if errors else 0))
+    words = []
+    for index in sorted(cells):
+        words.extend((index, cells[index]))
+    for char in sorted(font):
+        words.append(char)
+        words.extend(font[char])
+    message = struct.pack("<BBBBHH%dH" % len(words), protocol_version, flags,
+            (background or 0) & 0x0f, 0, len(cells), len(font), *words)
+    if errors:
+        message += "\n".join(e.encode("utf-8") if isinstance(e, unicode)
+                else e for e in errors)
+    return message
+
+
+# the messages clients can send, by kind, and the types of what comes after
+# the kind in each.
+client_messages = {
+    "run": (), "ack": (), "pause": (), "resume": (), "dump": (),
+    "watch": (basestring,), "keys": (list,), "trace": ((int, long, float),),
+}
+
+
+def parse(data):
+    """Decode a message from a client, or return None if it isn't one we
+    understand; nothing a client sends should be able to get any further
+    than this if it's the wrong shape.
+    """
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return None
+    if (not isinstance(message, list) or not message
+            or not isinstance(message[0], basestring)
+            or message[0] not in client_messages):
+        return None
+    shape = client_messages[message[0]]
+    if len(message) != len(shape) + 1:
+        return None
+    for argument, kind in zip(message[1:], shape):
+        if not isinstance(argument, kind):
+            return None
+    # keys are strings, which get fed in a character at a time.
+    if message[0] == "keys":
+        if not all(isinstance(k, basestring) for k in message[1]):
+            return None
+    # traces are a number of instructions, and clients only get so many.
+    if message[0] == "trace":
+        if isinstance(message[1], bool):
+            return None
+        try:
+            message[1] = max(0, min(int(message[1]), Tracer.size))
+        except (ValueError, OverflowError):
+            return None
+    return message
 
 
 class WebCPU(DCPU16, OutputCPU, InputCPU, LoopDetecting):
-    def __init__(self, protocol):
-        "Given a twisted protocol, initialize a WebCPU."
-        self.protocol = protocol
+    def __init__(self, session):
+        """Given a session (see sixteen.web.sessions) to keep changes to the
+        display in, initialize a WebCPU.
+        """
+        self.session = session
         # copy my own `registers` dict.
         self.registers = self._registers.copy()
         # this gets turned into True if we suspect the program is looping.
         self.stop = False
+        # the character in each cell of vram, and for each character, the
+        # cells it's in; change_letter keeps them up to date, so a change to
+        # the font only has to touch the cells that use it.
+        cells = self.vram[1] - self.vram[0]
+        self.cell_chars = [0] * cells
+        self.char_cells = [set() for _ in xrange(128)]
+        self.char_cells[0].update(xrange(cells))
         self.RAM = MemoryMap(self.cells, [
             (self.vram, self.change_letter),
             (self.background, self.change_background),
             (self.chars, self.change_character),
+            (self.keyring_region, self.keyring_write),
+        ], [
+            (self.keyring_region, self.keyring_read),
         ])
-        # read the default characters to the RAM
-        self.RAM[self.chars[0]:] = characters
+        # install the default characters all at once, rather than a callback
+        # per word, and have the frontend draw the font and every cell.
+        self.RAM.load(self.chars[0], characters)
+        self.session.chars_changed.update(default_font)
+        self.session.letters_changed.update((n, 0) for n in xrange(cells))
 
         # And set the input pointer.
         self.RAM[0x9010] = 0x9000
@@ -39,96 +139,364 @@ class WebCPU(DCPU16, OutputCPU, InputCPU, LoopDetecting):
             top = self.RAM[index - 1]
             bottom = value
             location = ((index - 1) - self.chars[0]) // 2
-        # use sixteen.output.OutputCPU.character to get a list of rows.
-        rows = self.character(top, bottom)
-        # and set the chars_changed to the rows
-        self.protocol.chars_changed[location] = rows
-        # ugly hack: make the frontend refresh the ones that have been changed
-        # (might be too slow)
-        for addr in (a for a in xrange(*self.vram) if (
-            self.RAM[a] & 0b0000000001111111) == location):
-             self.change_letter(addr, self.RAM[addr])
+        # the frontend turns the words into a bitmap itself.
+        self.session.chars_changed[location] = top, bottom
+        # make the frontend redraw the cells that use this character.
+        for offset in self.char_cells[location]:
+            self.session.letters_changed[offset] = self.RAM.peek(
+                    self.vram[0] + offset)
 
     def change_background(self, index, value):
-        # format the background color as an html/css hex color.
-        background = "#%02x%02x%02x" % self.color(value & 0x0f)
-        self.protocol.change_background = background
+        # the frontend only needs the four bits of color.
+        self.session.change_background = value & 0x0f
 
     def change_letter(self, index, value):
-        "This is called whenever a cell of vram is changed."
-        # get the data from sixteen.output.OutputCPU.letter
-        x, y, foreground, background, blink, char = self.letter(index, value)
-        self.protocol.letters_changed[(x, y)] = {
-            "x": x, "y": y, "char": char, "blink": blink,
-            # format the background and foreground tuples as html/css colors.
-            "foreground": "#%02x%02x%02x" % foreground,
-            "background": "#%02x%02x%02x" % background,
-        }
+        """This is called whenever a cell of vram is changed. The frontend
+        gets the raw word and works out the character and colors itself.
+        """
+        offset = index - self.vram[0]
+        self.session.letters_changed[offset] = value
+        # move the cell from its old character's set to its new one's.
+        char = value & 0b0000000001111111
+        old = self.cell_chars[offset]
+        if char != old:
+            self.char_cells[old].discard(offset)
+            self.char_cells[char].add(offset)
+            self.cell_chars[offset] = char
 
 
-class DCPU16Protocol(protocol.Protocol):
-    cycle_counter = 0
+class Machine(object):
+    """A program running in a session (see sixteen.web.sessions) and the
+    websocket clients viewing it: the one controlling it and any number of
+    spectators. The program runs on its own, in slices scheduled on the
+    reactor, and changes go out as frames -- at most "fps" of them a second.
 
-    def __init__(self, code):
-        # and the letters_changed list
+    Each frame gets encoded once and written to every viewer that's keeping
+    up. If a viewer falls behind, it skips frames until it's caught up and
+    then gets a snapshot of the whole display instead, as do viewers that
+    join late; the snapshot is encoded once, too. If every viewer is behind,
+    changes pile up into the next frame instead of queueing.
+    """
+    fps = 30
+
+    def __init__(self, code, sessions, reactor=reactor, fps=fps):
+        self.sessions = sessions
+        self.reactor = reactor
+        self.fps = fps
+        self.session = sessions.open(code)
+        # what spectators ask for to watch this; hard to guess, so only the
+        # people the controller tells can.
+        self.token = os.urandom(8).encode("hex")
+        self.controller = None
+        self.viewers = []
+        # the whole display, as of the last slice, and the errors since the
+        # program was last resumed, for snapshots.
+        self.cells = {}
+        self.font = {}
+        self.background = None
+        self.shown_errors = []
+        self._snapshot = None
+        # the changes that haven't been sent yet.
         self.letters_changed = {}
         self.chars_changed = {}
         self.change_background = None
         self.errors = []
-        # intialize the cpu
-        self.cpu = WebCPU(self)
-        # read the code from the factory to the RAM
-        self.cpu.RAM[:len(code)] = code
-
-    def dump_cpu(self, op, args):
-        if self.cpu.cycles >= self.cycle_counter:
-            self.cycle_counter += 100
-            print "---- " * 11
-            print "A    B    C    I    J    X    Y    Z    SP   PC   O"
-            print "---- " * 11
-        rs = self.cpu.registers
-        rs["dis"] = str("%s %s" % (op, args))
-        s = ("%(A)04x %(B)04x %(C)04x %(I)04x %(J)04x %(X)04x %(Y)04x %(Z)04x"
-                " %(SP)04x %(PC)04x %(O)04x: %(dis)s") % rs
-        print s
+        # the next scheduled slice, if there is one; whether there's a slice
+        # running; whether the controller has paused us, or an error has;
+        # whether the program's looping; and when the next frame's due and
+        # whether the last one said we'd stopped.
+        self.call = None
+        self.running = False
+        self.paused = False
+        self.halted = False
+        self.stop = False
+        self.next_frame = None
+        self.sent_stop = False
 
-    def dataReceived(self, data):
-        # get the keypresses and the number of cycles from the frontend
-        keypresses, count = json.loads(data)
-        for k in keypresses:
-            self.cpu.keyboard_input(ord(k))
-        try:
-            # cycle as many times as we're supposed to,
-            for _ in xrange(count):
-                # ... checking for infinite loops.
-                if not self.cpu.is_looping():
-                    op, args = self.cpu.cycle()
-                    self.dump_cpu(op, args)
-                else:
-                    break
-        # if we get any errors, let the frontend know.
-        except Exception as e:
-            self.errors.append(str(e))
-        # and then pass everything to the frontend.
+    def attach(self, viewer, controlling=False):
+        "Start sending frames to a viewer."
+        self.viewers.append(viewer)
+        if controlling:
+            self.controller = viewer
+        if self.cells:
+            # it's missed everything so far.
+            viewer.stale = True
+            self.catch_up(viewer)
+        if controlling:
+            self.wake()
+
+    def detach(self, viewer):
+        """Stop sending frames to a viewer. Return True if that was the last
+        one, in which case the program's gone.
+        """
+        self.viewers.remove(viewer)
+        if not self.viewers:
+            self.paused = True
+            self.unschedule()
+            self.sessions.close(self.session)
+            return True
+        if viewer is self.controller:
+            # nobody's left to pause it, so it's on for the audience.
+            self.controller = None
+            self.paused = False
+            self.wake()
+        return False
+
+    def feed(self, keys):
+        self.sessions.feed(self.session, keys)
+        # a program waiting for a key might have something to do now.
+        self.wake()
+
+    def pause(self):
+        self.paused = True
+        self.unschedule()
+
+    def resume(self):
+        self.paused = self.halted = False
+        self.shown_errors = []
+        self._snapshot = None
+        self.wake()
+
+    def trace(self, size):
+        "Start (or, with 0, stop) tracing the program's last instructions."
+        self.sessions.trace(self.session, size)
+
+    def dump(self):
+        "Have the program's trace printed on the server."
+        self.sessions.dump(self.session)
+
+    def acked(self, viewer):
+        "A viewer's drawn a frame; it might be ready for another."
+        self.catch_up(viewer)
+        # there might be changes that were waiting on this.
+        self.send_frame(not self.active())
+
+    def active(self):
+        "Whether there's a slice running or coming up."
+        return self.running or self.call != None
+
+    def wake(self):
+        "Start running slices again, if we'd stopped and we're allowed to."
+        if self.active() or self.paused or self.halted:
+            return
+        self.sessions.wake(self.session)
+        self.call = self.reactor.callLater(0, self.run_slice)
+
+    def unschedule(self):
+        if self.call != None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def run_slice(self):
+        "Have the session run a slice."
+        self.call = None
+        self.running = True
+        d = self.sessions.run(self.session)
+        d.addCallbacks(self.slice_done, self.slice_failed)
+
+    def slice_done(self, (changes, stopped, wait)):
+        "Take in what a slice did, send a frame and schedule the next."
+        self.running = False
+        cells, characters, background, errors, self.stop = changes
+        self.letters_changed.update(cells)
+        self.chars_changed.update(characters)
+        self.cells.update(cells)
+        self.font.update(characters)
+        if background != None:
+            self.change_background = self.background = background
+        self.errors.extend(errors)
+        self.shown_errors.extend(errors)
+        self._snapshot = None
+        if errors:
+            self.halted = True
+        # once it's stopped, only a keypress (or the controller) can start it
+        # again, so there's no point in running more slices until then;
+        # everything left has to go out now.
+        self.send_frame(stopped)
+        if not stopped and not self.paused:
+            self.call = self.reactor.callLater(wait, self.run_slice)
+
+    def slice_failed(self, failure):
+        "Something went wrong outside of the program; stop."
+        self.running = False
+        self.halted = True
+        self.errors.append(failure.getErrorMessage())
+        self.shown_errors.append(failure.getErrorMessage())
+        self._snapshot = None
+        self.send_frame(True)
+
+    def snapshot(self):
+        "The whole display as a message, for viewers that missed frames."
+        if self._snapshot == None:
+            self._snapshot = encode(self.cells, self.font, self.background,
+                    self.stop, self.shown_errors)
+        return self._snapshot
+
+    def catch_up(self, viewer):
+        "Send a viewer that's missed frames a snapshot, if it's ready."
+        if viewer.stale and viewer.ready():
+            viewer.stale = False
+            viewer.send(self.snapshot())
+
+    def send_frame(self, final=False):
+        """Send whatever's changed, if anybody's keeping up and it's been long
+        enough since the last frame (or this is the last one for a while).
+        """
+        if not any(viewer.ready() for viewer in self.viewers):
+            return
+        now = self.reactor.seconds()
+        if not final and self.next_frame != None and now < self.next_frame:
+            return
+        if not (self.letters_changed or self.chars_changed or self.errors
+                or self.change_background != None
+                or self.stop != self.sent_stop):
+            return
+        # keep to the frame rate on average, unless it's been so long since
+        # the last one that we'd send a burst.
+        period = 1.0 / self.fps
+        if self.next_frame == None or now - self.next_frame >= period:
+            self.next_frame = now
+        self.next_frame += period
+        self.sent_stop = self.stop
         self.write_changes()
 
     def write_changes(self):
-        "Write the changes to the websockets client and reset."
-        changes = {
-            # None if there's no new background color, otherwise a color.
-            "background": self.change_background,
-            # the cells that have been changed since last time
-            "cells": self.letters_changed.values(),
-            # the characters (fonts) that have been changed
-            "characters": self.chars_changed,
-            # any errors we've encountered
-            "errors": self.errors,
-            # whether the frontend should stop.
-            "halt": self.cpu.stop,
-        }
+        "Write the changes to every viewer that's keeping up, and reset."
+        message = encode(self.letters_changed, self.chars_changed,
+            self.change_background, self.stop, self.errors)
+        for viewer in self.viewers:
+            if viewer.stale:
+                continue
+            if viewer.ready():
+                viewer.send(message)
+            else:
+                # it'll need the whole display once it's caught up.
+                viewer.stale = True
         # reset everything
-        self.transport.write(json.dumps(changes))
         self.letters_changed = {}
         self.chars_changed = {}
         self.change_background = None
         self.errors = []
+
+
+class DCPU16Protocol(protocol.Protocol):
+    """A websocket client viewing a Machine. The client's first message says
+    what it wants to view: ["run"] to run its own program (the one it was
+    made with) or ["watch", token] to watch somebody else's. Whoever runs a
+    program controls it and gets told its token, as a text message of
+    ["machine", token], to pass on to spectators. Machines are looked up by
+    token in "machines", which should be shared between connections.
+
+    After that, the client sends JSON lists (anything else gets ignored; see
+    parse): ["keys", [...]] for keypresses, ["ack"] when it's drawn a frame,
+    ["pause"] and ["resume"], and ["trace", size] and ["dump"] for tracing
+    the program (see sixteen.trace). Only the controller's keys, pauses,
+    resumes and traces count. A client only gets a frame while it has fewer
+    than "in_flight_limit" that it hasn't drawn yet.
+
+    Where programs actually run is up to "sessions" (see
+    sixteen.web.sessions); by default, it's right here in this process.
+    """
+    reactor = reactor
+    fps = 30
+    in_flight_limit = 2
+
+    def __init__(self, code, sessions=None, machines=None):
+        if sessions == None:
+            from sixteen.web.sessions import LocalSessions
+            sessions = LocalSessions(self.reactor.seconds)
+        self.code = code
+        self.sessions = sessions
+        self.machines = {} if machines == None else machines
+        self.machine = None
+        # the frames the client hasn't drawn yet, and whether it's missed
+        # any and needs a snapshot.
+        self.in_flight = 0
+        self.stale = False
+
+    def connectionMade(self):
+        # send our messages as binary frames; txws sends text otherwise.
+        setBinaryMode = getattr(self.transport, "setBinaryMode", None)
+        if setBinaryMode != None:
+            setBinaryMode(True)
+
+    def connectionLost(self, reason):
+        self.leave()
+
+    def dataReceived(self, data):
+        message = parse(data)
+        if message == None:
+            # drop anything we don't understand.
+            return
+        kind = message[0]
+        if kind == "watch":
+            self.watch(message[1])
+            return
+        if self.machine == None:
+            # anything else means it wants to run its own.
+            self.run()
+            if self.machine == None:
+                return
+        machine = self.machine
+        if kind == "ack":
+            self.in_flight = max(0, self.in_flight - 1)
+            machine.acked(self)
+        elif machine.controller is not self:
+            # spectators just watch.
+            return
+        elif kind == "keys":
+            machine.feed(message[1])
+        elif kind == "pause":
+            machine.pause()
+        elif kind == "resume":
+            machine.resume()
+        elif kind == "trace":
+            machine.trace(message[1])
+        elif kind == "dump":
+            machine.dump()
+
+    def run(self):
+        "Start running our own program, and control it."
+        from sixteen.web.sessions import SessionLimit
+        self.leave()
+        try:
+            machine = Machine(self.code, self.sessions, self.reactor,
+                    self.fps)
+        except SessionLimit:
+            self.refuse("too many programs are running; try again later")
+            return
+        self.machines[machine.token] = machine
+        self.machine = machine
+        # a text message, since binary ones are all frames.
+        self.transport.write(unicode(json.dumps(["machine", machine.token])))
+        machine.attach(self, True)
+
+    def watch(self, token):
+        "Start watching somebody else's program."
+        machine = self.machines.get(token)
+        if machine == None:
+            self.refuse("there's nothing to watch at %s" % token)
+            return
+        self.leave()
+        self.machine = machine
+        machine.attach(self)
+
+    def leave(self):
+        "Stop viewing whatever we're viewing."
+        machine, self.machine = self.machine, None
+        self.stale = False
+        if machine != None and machine.detach(self):
+            self.machines.pop(machine.token, None)
+
+    def refuse(self, error):
+        "Tell the client what went wrong and hang up."
+        self.transport.write(encode({}, {}, halt=True, errors=[error]))
+        self.transport.loseConnection()
+
+    def ready(self):
+        "Whether the client's drawn enough frames to be sent another."
+        return self.in_flight < self.in_flight_limit
+
+    def send(self, message):
+        self.in_flight += 1
+        self.transport.write(message)
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""Where the programs sixteen-web runs live.
+
+A Session is one running program: the WebCPU, the governor that keeps it to
+time, and the changes it's made to the display since they were collected.
+Sessions either run right in the reactor's process (LocalSessions) or are
+spread over a pool of worker processes (WorkerPool), so that one busy program
+doesn't hold up every other connection. Either way, DCPU16Protocol asks for a
+slice at a time and gets a Deferred of the changes back; only the changes
+cross between processes.
+"""
+
+import os
+import sys
+import time
+import itertools
+from multiprocessing import Process, Pipe
+from twisted.internet import defer, reactor
+from twisted.internet.interfaces import IReadDescriptor
+from zope.interface import implementer
+from sixteen.clock import Governor
+from sixteen.trace import Tracer
+from sixteen.web.server import WebCPU
+
+
+class Session(object):
+    """Run a program for one or more viewers. "quota" is the most cycles a
+    slice can run, so that every session on a worker gets its turn and
+    frames go out on time. It starts out at a guess; after that, it's
+    however many cycles this host turns out to run in "slice_time" seconds
+    (but never fewer than "minimum_quota"), so slow hosts run shorter slices
+    and fast ones longer. If "trace" is a number, that many of the last
+    instructions get kept (see sixteen.trace) and printed if the program
+    hits an error.
+    """
+    quota = 2000
+    minimum_quota = 100
+    slice_time = 0.005
+    # how fast this host runs the program, in cycles a second, on average.
+    speed = None
+    # the most seconds a program waiting for a key gets to catch up on.
+    idle_limit = 600
+    tracer = None
+
+    def __init__(self, code, clock=time.time, trace=None):
+        # the changes to the display, which WebCPU fills in.
+        self.letters_changed = {}
+        self.chars_changed = {}
+        self.change_background = None
+        self.errors = []
+        # intialize the cpu
+        self.cpu = WebCPU(self)
+        # read the code from the factory to the RAM
+        self.cpu.RAM[:len(code)] = code
+        # and keep it running at the proper rate.
+        self.clock = clock
+        self.governor = Governor(self.cpu, clock=clock)
+        self.trace(trace)
+
+    def trace(self, size):
+        """Start keeping the last "size" instructions, or stop and forget
+        them if it's 0 or None.
+        """
+        size = int(size or 0)
+        if size < 0:
+            raise ValueError("can't trace %d instructions" % size)
+        self.tracer = Tracer(self.cpu, size) if size else None
+
+    def dump_trace(self, why="trace"):
+        "Print the trace, if there is one."
+        if self.tracer != None:
+            sys.stdout.write("%s\n%s\n" % (why, self.tracer.format()))
+            sys.stdout.flush()
+
+    def feed(self, keys):
+        "Put some keypresses (a list of strings) in the keyboard queue."
+        # the keys come in at the cycle it is now, not when it stopped.
+        self.governor.skip(self.idle_limit)
+        self.cpu.feed(u"".join(keys))
+
+    def wake(self):
+        """Get ready to run again after being stopped for a while. A program
+        that was waiting all along counts the cycles it would have spent
+        waiting (see Governor.skip), but nothing gets run to catch up.
+        """
+        self.governor.skip(self.idle_limit)
+        self.governor.reset()
+
+    def run_slice(self):
+        """Run however many cycles are due and return (changes, stopped,
+        wait): the changes since last time (see collect), whether the program
+        has stopped (because it's looping or because of an error) and how
+        long to wait before the next slice.
+        """
+        self.cpu.pump()
+        # whatever's left over is still due next time.
+        count = min(self.governor.due(), self.quota)
+        halted = False
+        start = self.clock()
+        try:
+            if self.tracer == None:
+                ran = self.governor.execute(count)
+            else:
+                ran = self.execute_traced(count)
+        # if we get any errors, let the frontend know and stop.
+        except Exception as e:
+            self.errors.append(str(e))
+            self.dump_trace(str(e))
+            halted = True
+        else:
+            self.adapt(ran, self.clock() - start)
+        stopped = halted or self.cpu.stop
+        return self.collect(), stopped, self.governor.wait()
+
+    def execute_traced(self, count):
+        "Like Governor.execute, but recording every instruction."
+        cpu, record = self.cpu, self.tracer.record
+        for n in xrange(count):
+            # a spinning program would have used up the rest.
+            if cpu.is_looping():
+                cpu.fast_forward(count - n)
+                return n
+            record()
+            cpu.cycle()
+        return count
+
+    def adapt(self, ran, elapsed):
+        """Given that a slice ran a number of cycles in so many seconds, work
+        out the quota for the next ones.
+        """
+        # too short a slice doesn't say much about how fast we are.
+        if ran < self.minimum_quota or elapsed <= 0:
+            return
+        speed = ran / elapsed
+        if self.speed == None:
+            self.speed = speed
+        else:
+            self.speed += (speed - self.speed) * 0.25
+        self.quota = max(self.minimum_quota,
+                int(self.speed * self.slice_time))
+
+    def collect(self):
+        """Return and forget the changes to the display: (cells, characters,
+        background, errors, stop), where "stop" is whether the program seems
+        to be looping.
+        """
+        changes = (self.letters_changed, self.chars_changed,
+                self.change_background, self.errors, self.cpu.stop)
+        self.letters_changed = {}
+        self.chars_changed = {}
+        self.change_background = None
+        self.errors = []
+        return changes
+
+
+class SessionLimit(Exception):
+    "There are already as many sessions as there are allowed to be."
+
+
+class LocalSessions(object):
+    """Run sessions right here, in the reactor's process. "clock" is what
+    their governors tell time with; "trace" is how many instructions each
+    one traces to begin with.
+    """
+    def __init__(self, clock=time.time, max_sessions=None, trace=None):
+        self.clock = clock
+        self.max_sessions = max_sessions
+        self.trace_size = trace
+        self.sessions = {}
+        self._ids = itertools.count()
+
+    def open(self, code):
+        "Start a session running a program and return its id."
+        if (self.max_sessions != None
+                and len(self.sessions) >= self.max_sessions):
+            raise SessionLimit(self.max_sessions)
+        sid = next(self._ids)
+        self.sessions[sid] = Session(code, self.clock, self.trace_size)
+        return sid
+
+    def run(self, sid):
+        "Run a slice; return a Deferred that fires with what run_slice did."
+        return defer.succeed(self.sessions[sid].run_slice())
+
+    def feed(self, sid, keys):
+        self.sessions[sid].feed(keys)
+
+    def wake(self, sid):
+        self.sessions[sid].wake()
+
+    def trace(self, sid, size):
+        self.sessions[sid].trace(size)
+
+    def dump(self, sid):
+        self.sessions[sid].dump_trace("session %d" % sid)
+
+    def close(self, sid):
+        self.sessions.pop(sid, None)
+
+
+def worker(connection, inherited=()):
+    """Run sessions in a worker process, doing what comes in over the
+    connection, in order, until it's closed. Since every session only asks
+    for one slice at a time and each slice is limited by its quota, sessions
+    take turns.
+
+    "inherited" are the pool's ends of this and other workers' connections
+    that came along with the fork; they get closed, so that workers see
+    when the pool goes away.
+    """
+    for other in inherited:
+        other.close()
+    sessions = {}
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            break
+        kind, sid = command[:2]
+        # whatever goes wrong only goes wrong for the session it's about;
+        # the pool hears about it, and the other sessions keep going.
+        try:
+            if kind == "open":
+                sessions[sid] = Session(command[2], trace=command[3])
+            elif kind == "run":
+                connection.send((sid, sessions[sid].run_slice(), None))
+            elif kind == "feed":
+                sessions[sid].feed(command[2])
+            elif kind == "wake":
+                sessions[sid].wake()
+            elif kind == "trace":
+                sessions[sid].trace(command[2])
+            elif kind == "dump":
+                sessions[sid].dump_trace("session %d" % sid)
+            elif kind == "close":
+                sessions.pop(sid, None)
+        except Exception as e:
+            if kind != "close":
+                connection.send((sid, None, "%s: %s" % (type(e).__name__,
+                    e)))
+
+
+@implementer(IReadDescriptor)
+class WorkerReader(object):
+    "Hand whatever a worker sends back to a callback, from the reactor."
+    def __init__(self, connection, received, lost):
+        self.connection = connection
+        self.received = received
+        self.lost = lost
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def doRead(self):
+        try:
+            while self.connection.poll():
+                self.received(self.connection.recv())
+        except (EOFError, IOError):
+            self.lost(self)
+
+    def connectionLost(self, reason):
+        self.lost(self)
+
+    def logPrefix(self):
+        return "worker"
+
+
+class WorkerPool(object):
+    """Run sessions in a pool of worker processes (by default, one per
+    cpu), each new session going to whichever worker has the fewest. Up to
+    "max_sessions" can run at once, each tracing "trace" instructions to
+    begin with. With no processes, workers can be added with "add".
+
+    If a worker dies, its sessions fail, and if the pool started it, another
+    one takes its place.
+    """
+    def __init__(self, processes=None, max_sessions=None, trace=None,
+            reactor=reactor):
+        self.max_sessions = max_sessions
+        self.trace_size = trace
+        self.reactor = reactor
+        # the connection to each worker, the workers' sessions, which
+        # worker each session is on, the Deferreds waiting for slices and
+        # the errors that sessions haven't been told about yet.
+        self.connections = []
+        self.processes = []
+        self.readers = {}
+        self.load = {}
+        self.placement = {}
+        self.waiting = {}
+        self.errors = {}
+        self._ids = itertools.count()
+        if processes == None:
+            processes = os.sysconf("SC_NPROCESSORS_ONLN")
+        for _ in xrange(processes):
+            self.spawn()
+
+    def spawn(self):
+        "Start a worker process and start using it."
+        ours, theirs = Pipe()
+        process = Process(target=worker,
+                args=(theirs, self.connections + [ours]))
+        process.daemon = True
+        process.start()
+        theirs.close()
+        self.add(ours, process)
+
+    def add(self, connection, process=None):
+        "Start using a worker, given our end of its connection."
+        self.connections.append(connection)
+        self.processes.append(process)
+        self.load[connection] = set()
+        reader = self.readers[connection] = WorkerReader(connection,
+                self.received, self.lost)
+        self.reactor.addReader(reader)
+
+    def send(self, sid, command):
+        """Send a command about a session to its worker, if it still has
+        one.
+        """
+        connection = self.placement.get(sid)
+        if connection == None:
+            return
+        try:
+            connection.send(command)
+        except (IOError, OSError):
+            self.lost(self.readers[connection])
+
+    def open(self, code):
+        "Start a session on the least busy worker and return its id."
+        if (self.max_sessions != None
+                and len(self.placement) >= self.max_sessions):
+            raise SessionLimit(self.max_sessions)
+        if not self.connections:
+            # there's nowhere to run it.
+            raise SessionLimit(0)
+        connection = min(self.connections, key=lambda c: len(self.load[c]))
+        sid = next(self._ids)
+        self.placement[sid] = connection
+        self.load[connection].add(sid)
+        self.send(sid, ("open", sid, list(code), self.trace_size))
+        return sid
+
+    def run(self, sid):
+        "Run a slice; return a Deferred that fires with what run_slice did."
+        if sid in self.errors:
+            return defer.fail(RuntimeError(self.errors.pop(sid)))
+        d = self.waiting[sid] = defer.Deferred()
+        self.send(sid, ("run", sid))
+        return d
+
+    def feed(self, sid, keys):
+        self.send(sid, ("feed", sid, list(keys)))
+
+    def wake(self, sid):
+        self.send(sid, ("wake", sid))
+
+    def trace(self, sid, size):
+        self.send(sid, ("trace", sid, size))
+
+    def dump(self, sid):
+        self.send(sid, ("dump", sid))
+
+    def close(self, sid):
+        self.send(sid, ("close", sid))
+        self.errors.pop(sid, None)
+        connection = self.placement.pop(sid, None)
+        if connection != None:
+            self.load[connection].discard(sid)
+
+    def received(self, (sid, result, error)):
+        "A slice finished, or something went wrong; pass it on."
+        d = self.waiting.pop(sid, None)
+        if error != None:
+            self.fail(sid, error, d)
+        elif d != None:
+            d.callback(result)
+
+    def fail(self, sid, error, d=None):
+        """A session's gone wrong; fail its slice, or the next one if it
+        isn't running one.
+        """
+        if d != None:
+            d.errback(RuntimeError(error))
+        elif sid in self.placement:
+            self.errors[sid] = error
+
+    def lost(self, reader):
+        """A worker went away; stop using it, fail its sessions and, if we
+        started it, start another.
+        """
+        connection = reader.connection
+        if connection not in self.load:
+            return
+        self.reactor.removeReader(reader)
+        del self.readers[connection]
+        index = self.connections.index(connection)
+        del self.connections[index]
+        process = self.processes.pop(index)
+        for sid in self.load.pop(connection):
+            del self.placement[sid]
+            d = self.waiting.pop(sid, None)
+            if d != None:
+                d.errback(RuntimeError("worker process died"))
+            else:
+                self.errors[sid] = "worker process died"
+        connection.close()
+        if process != None:
+            process.join(0)
+            self.spawn()
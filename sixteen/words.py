@@ -14,6 +14,7 @@ From the docs:
 """
 
 from math import log
+from array import array
 
 
 def from_hex(word):
@@ -48,6 +49,75 @@ def from_opcode(o, a, b):
     return o ^ (a << 4) ^ (b << 10)
 
 
+# how many extra words each of the 64 value codes consumes: [next word + register]
+# (0x10-0x17), [next word] (0x1e) and next word (0x1f) take one.
+value_lengths = tuple(int(0x10 <= c < 0x18 or c in (0x1e, 0x1f))
+        for c in xrange(0x40))
+
+# base cycle costs, from the spec; each next word used costs one more, and an
+# IFx costs one more if the test fails.
+basic_cycles = {
+    0x1: 1, 0x2: 2, 0x3: 2, 0x4: 2, 0x5: 3, 0x6: 3, 0x7: 2, 0x8: 2,
+    0x9: 1, 0xa: 1, 0xb: 1, 0xc: 2, 0xd: 2, 0xe: 2, 0xf: 2,
+}
+
+special_cycles = {
+    0x01: 2,
+}
+
+
+class DecodeTables(object):
+    """Everything there is to know about decoding a word, precomputed for all
+    0x10000 of them so that decoding is a single index. The tables are
+    compact arrays, and they're only built the first time something asks for
+    one:
+
+    - "opcode", "a" and "b" are the fields from as_opcode.
+    - "length" is the length of the instruction in words.
+    - "cycles" is its base cycle cost, including next words.
+    - "valid" is 1 if the word is a valid instruction and 0 otherwise.
+    """
+    built = False
+
+    def __getattr__(self, name):
+        # __getattr__ only gets called for attributes that aren't there yet
+        if self.built:
+            raise AttributeError(name)
+        self.build()
+        return getattr(self, name)
+
+    def build(self):
+        "Fill in all of the tables."
+        opcodes, a_s, b_s = array("B"), array("B"), array("B")
+        lengths, cycles, valid = array("B"), array("B"), array("B")
+        for word in xrange(0x10000):
+            o, a, b = as_opcode(word)
+            opcodes.append(o)
+            a_s.append(a)
+            b_s.append(b)
+            if o == 0x00:
+                # special opcodes only take b as an argument
+                length = 1 + value_lengths[b]
+                cost = special_cycles.get(a)
+            else:
+                length = 1 + value_lengths[a] + value_lengths[b]
+                cost = basic_cycles[o]
+            lengths.append(length)
+            if cost == None:
+                cycles.append(0)
+                valid.append(0)
+            else:
+                cycles.append(cost + length - 1)
+                valid.append(1)
+        self.opcode, self.a, self.b = opcodes, a_s, b_s
+        self.length, self.cycles, self.valid = lengths, cycles, valid
+        self.built = True
+
+
+# the shared decode tables.
+tables = DecodeTables()
+
+
 def bit_iter(bits, n):
     "Iterate over the bits of an integer, padding it to `n` digits."
     if bits == 0: